@@ -0,0 +1,450 @@
+"""
+This module contains the simulated annealing engine used by run_sa.
+
+A state is a placement with exactly N switches. A move takes the switch off
+one arc and puts it on an open arc, and is scored with IncrementalENS in time
+proportional to the depth of the sectors it touches. Moves are applied in
+place, the current ENS is kept up to date, and the random numbers of a block
+of moves are drawn at once. With a batch size above 1, each step samples
+several moves on distinct arcs and scores them with one SwapBatch call.
+
+parallel_anneal runs several chains in a process pool, either independent
+annealing runs that periodically restart the worst chain from the best
+placement, or parallel tempering with one chain per temperature that swaps
+placements between neighbouring temperatures. Workers memory-map the cached
+graph file, or receive the graph arrays of graphs that are not cached, and
+do not use Gurobi.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from math import exp, log
+from time import perf_counter
+from util import Graph
+from cache import read_graph_file
+from ens import IncrementalENS, SwapBatch, get_evaluator
+
+COOLING_SCHEDULES = ('geometric', 'linear', 'lundy')
+PARALLEL_MODES = ('multistart', 'tempering')
+
+@dataclass
+class SAConfig:
+    """
+    Stores the settings of anneal\\
+    iterations : number of moves tried\\
+    schedule : cooling schedule, 'geometric' (T0 * ratio^(k / iterations)),
+    'linear' (from T0 to T0 * ratio) or 'lundy' (T / (1 + beta * T), reaching T0 * ratio)\\
+    initial_acceptance : probability of accepting an average uphill move at the initial temperature\\
+    final_ratio : final temperature as a fraction of the initial temperature\\
+    initial_temperature : if given, used instead of initial_acceptance\\
+    seed : seed of the random generator, an int or a np.random.SeedSequence\\
+    block_size : number of moves whose random numbers are drawn at once\\
+    record_every : the current ENS and temperature are recorded every record_every moves\\
+    chains : number of chains, more than 1 runs parallel_anneal\\
+    mode : 'multistart' (independent chains, the worst restarts from the best placement) or
+    'tempering' (one chain per temperature, placements are exchanged between neighbouring temperatures)\\
+    exchange_every : number of moves of each chain between exchanges of placements\\
+    max_workers : number of worker processes, 1 runs the chains in this process\\
+    local_search : if true, run_sa polishes the best placement with local_search\\
+    batch_size : number of candidate moves on distinct arcs scored together per step, see
+    SwapBatch. The best candidate that passes its Metropolis test is applied, 1 tries single moves
+    """
+    iterations : int = 10**5
+    schedule : str = 'geometric'
+    initial_acceptance : float = 0.5
+    final_ratio : float = 1e-3
+    initial_temperature : float = None
+    seed : int = None
+    block_size : int = 2**14
+    record_every : int = 1000
+    chains : int = 1
+    mode : str = 'multistart'
+    exchange_every : int = 10**4
+    max_workers : int = None
+    local_search : bool = True
+    batch_size : int = 1
+
+@dataclass
+class SAResult:
+    """
+    Stores the output of anneal\\
+    placement : best placement vector found\\
+    obj : ENS of the best placement, including the ENS lower bound\\
+    stats : iterations, accepted and improving moves, temperatures, time and moves per second\\
+    energies : ENS of the current placement, every record_every moves\\
+    temperatures : temperature, every record_every moves\\
+    current : placement vector at the end of the run\\
+    chains : statistics of each chain of parallel_anneal
+    """
+    placement : np.ndarray
+    obj : float
+    stats : dict[str, float] = field(default_factory=dict)
+    energies : list[float] = field(default_factory=list)
+    temperatures : list[float] = field(default_factory=list)
+    current : np.ndarray = None
+    chains : list[dict[str, float]] = field(default_factory=list)
+
+def random_placement(G : Graph, N : int, rng : np.random.Generator) -> np.ndarray:
+    """
+    Returns a placement with the switches between the root and the substations
+    and N minus that many switches on distinct other arcs.
+    """
+    X = (G.tail == 0).astype(np.float64)
+    free = np.flatnonzero(G.tail != 0)
+    n_free = min(N - int(X.sum()), len(free))
+    X[rng.choice(free, size=n_free, replace=False)] = 1
+    return X
+
+def free_arcs(G : Graph, X : np.ndarray) -> tuple[list[int], list[int]]:
+    """
+    Returns the switched and the open arcs that moves choose from, the
+    switches between the root and the substations never move.
+    """
+    free = G.tail != 0
+    return np.flatnonzero(free & (X == 1)).tolist(), np.flatnonzero(free & (X == 0)).tolist()
+
+def initial_temperature(ens : IncrementalENS, on : list[int], off : list[int],
+        acceptance : float, rng : np.random.Generator, samples : int = 200) -> float:
+    """
+    Returns the temperature at which an average uphill move is accepted with
+    probability acceptance, from a sample of random moves.
+    """
+    uphill = []
+    for r, a in zip(rng.integers(len(on), size=samples).tolist(), rng.integers(len(off), size=samples).tolist()):
+        change = ens.swap_delta(on[r], off[a])
+        if change > 0:
+            uphill.append(change)
+    if not uphill:
+        return 1.0
+    return -float(np.mean(uphill)) / log(acceptance)
+
+def _run_stats(iterations : int, accepted : int, improved : int, T0 : float, T : float,
+        current_obj : float, elapsed : float) -> dict[str, float]:
+    """
+    Returns the statistics of a run of anneal, see SAResult.stats.
+    """
+    return {
+        'iterations' : iterations,
+        'accepted' : accepted,
+        'improved' : improved,
+        'initial_temperature' : T0,
+        'final_temperature' : T,
+        'current_obj' : current_obj,
+        'time' : elapsed,
+        'moves_per_second' : iterations / elapsed if elapsed > 0 else 0.0
+    }
+
+def anneal(G : Graph, N : int, config : SAConfig = None, X : np.ndarray = None,
+        start : int = 0, stop : int = None) -> SAResult:
+    """
+    Runs simulated annealing over placements of N switches.\\
+    G : graph to place switches on\\
+    N : number of switches, including the switches between the root and the substations\\
+    config : settings of the run, SAConfig() by default\\
+    X : initial placement vector, random by default\\
+    start, stop : if given, only moves start to stop of the schedule are run, to
+    continue a run from its current placement
+    """
+    if config is None:
+        config = SAConfig()
+    if config.schedule not in COOLING_SCHEDULES:
+        raise ValueError(f'Unknown cooling schedule {config.schedule}, expected one of {COOLING_SCHEDULES}')
+    begin = perf_counter()
+    rng = np.random.default_rng(config.seed)
+    evaluator = get_evaluator(G)
+    Elb = G.get_ens_lower_bound()
+
+    if X is None:
+        X = random_placement(G, N, rng)
+    ens = IncrementalENS(evaluator, X)
+
+    if stop is None:
+        stop = config.iterations
+    on, off = free_arcs(G, X)
+    if not on or not off:
+        # nothing to move, e.g. P = 0 or every arc switched
+        X = ens.placement()
+        T = config.initial_temperature or 0.0
+        stats = _run_stats(0, 0, 0, T, T, ens.ens + Elb, perf_counter() - begin)
+        return SAResult(X, ens.ens + Elb, stats, current = X)
+
+    T0 = config.initial_temperature
+    if T0 is None:
+        T0 = initial_temperature(ens, on, off, config.initial_acceptance, rng)
+    T_end = T0 * config.final_ratio
+    K = max(1, config.iterations)
+    ratio = (T_end / T0) ** (1 / K)
+    step = (T0 - T_end) / K
+    beta = (T0 - T_end) / (K * T0 * T_end)
+    schedule = COOLING_SCHEDULES.index(config.schedule)
+
+    # temperature of move start
+    if schedule == 0:
+        T = T0 * ratio ** start
+    elif schedule == 1:
+        T = T0 - step * start
+    else:
+        T = T0 / (1 + beta * T0 * start)
+
+    toggle = ens.toggle
+    delta = ens.delta
+    current = ens.ens
+    best = current
+    best_X = None
+    at_best = True
+    accepted = improved = 0
+    energies = []
+    temperatures = []
+
+    k = start
+    if config.batch_size > 1:
+        # batch_size candidate moves per step on distinct arcs, scored at once
+        batch = SwapBatch(ens)
+        on = np.array(on)
+        off = np.array(off)
+        width = min(config.batch_size, len(on), len(off))
+        next_record = -(-k // config.record_every) * config.record_every if config.record_every else k
+        while k < stop:
+            steps = -(-min(config.block_size, stop - k) // width)
+            removes = np.sort(rng.integers(len(on), size=(steps, width)), axis=1)
+            adds = rng.integers(len(off), size=(steps, width))
+            thresholds = -np.log(1 - rng.random((steps, width)))
+            # candidates repeating an arc of an earlier candidate of the step are dropped
+            repeated = np.zeros((steps, width), dtype=bool)
+            repeated[:, 1:] = removes[:, 1:] == removes[:, :-1]
+            by_add = np.argsort(adds, axis=1)
+            sorted_adds = np.take_along_axis(adds, by_add, axis=1)
+            repeated_add = np.zeros((steps, width), dtype=bool)
+            np.put_along_axis(repeated_add, by_add[:, 1:], sorted_adds[:, 1:] == sorted_adds[:, :-1], axis=1)
+            repeated |= repeated_add
+
+            for step_removes, step_adds, step_thresholds, step_repeated in zip(removes, adds, thresholds, repeated):
+                while config.record_every and next_record <= k:
+                    energies.append(current + Elb)
+                    temperatures.append(T)
+                    next_record += config.record_every
+
+                # Metropolis over the batch: the best move that passes its own acceptance test
+                change = batch.deltas(on[step_removes], off[step_adds])
+                change[step_repeated | (change > T * step_thresholds)] = np.inf
+                i = int(np.argmin(change))
+                if change[i] < np.inf:
+                    r = int(step_removes[i])
+                    a = int(step_adds[i])
+                    arc_on = int(on[r])
+                    arc_off = int(off[a])
+                    if at_best and change[i] > 0:
+                        best_X = ens.placement()
+                        at_best = False
+                    batch.swap(arc_on, arc_off)
+                    on[r] = arc_off
+                    off[a] = arc_on
+                    current = ens.ens
+                    accepted += 1
+                    if current < best:
+                        best = current
+                        at_best = True
+                        improved += 1
+
+                k += width
+                if schedule == 0:
+                    T = T0 * ratio ** k
+                elif schedule == 1:
+                    T = max(T0 - step * k, T_end)
+                else:
+                    T = T0 / (1 + beta * T0 * k)
+    else:
+        while k < stop:
+            size = min(config.block_size, stop - k)
+            removes = rng.integers(len(on), size=size).tolist()
+            adds = rng.integers(len(off), size=size).tolist()
+            # accept an uphill move of size d when d < -T log(u)
+            thresholds = (-np.log(1 - rng.random(size))).tolist()
+
+            for r, a, threshold in zip(removes, adds, thresholds):
+                if config.record_every and k % config.record_every == 0:
+                    energies.append(current + Elb)
+                    temperatures.append(T)
+
+                arc_on = on[r]
+                arc_off = off[a]
+                change = toggle(arc_on)
+                change += delta(arc_off)
+                if change <= 0 or change < T * threshold:
+                    if at_best and change > 0:
+                        # leaving the best placement, arc_on is already toggled off
+                        best_X = list(ens.X)
+                        best_X[arc_on] = 1
+                        at_best = False
+                    toggle(arc_off)
+                    on[r] = arc_off
+                    off[a] = arc_on
+                    current = ens.ens
+                    accepted += 1
+                    if current < best:
+                        best = current
+                        at_best = True
+                        improved += 1
+                else:
+                    toggle(arc_on)
+
+                k += 1
+                if schedule == 0:
+                    T *= ratio
+                elif schedule == 1:
+                    T -= step
+                else:
+                    T = T / (1 + beta * T)
+
+    placement = ens.placement() if at_best else np.array(best_X, dtype=np.float64)
+    stats = _run_stats(k - start, accepted, improved, T0, T, current + Elb, perf_counter() - begin)
+    return SAResult(placement, best + Elb, stats, energies, temperatures, ens.placement())
+
+"""
+Parallel chains
+"""
+
+# Graph of a worker process, set once by _set_worker_graph
+_worker_graph = None
+
+def _set_worker_graph(source : str | dict[str, np.ndarray]) -> None:
+    """
+    source : cached graph file, memory-mapped so workers share its pages, or
+    the arrays of a graph that is not cached
+    """
+    global _worker_graph
+    if isinstance(source, str):
+        _worker_graph = read_graph_file(source)
+    else:
+        _worker_graph = Graph.from_arrays(source)
+
+def _run_worker_chain(task : tuple) -> SAResult:
+    return anneal(_worker_graph, *task)
+
+def parallel_anneal(G : Graph, N : int, config : SAConfig = None) -> SAResult:
+    """
+    Runs config.chains annealing chains of config.iterations moves each in a
+    process pool, see SAConfig.mode. Every config.exchange_every moves the
+    chains stop, the best placement is updated and placements are exchanged.\\
+    Each chain draws from its own generator spawned from config.seed, so runs
+    with a seed are reproducible whatever the number of workers.\\
+    Returns the best placement of all chains, with the statistics of each chain in chains.
+    """
+    if config is None:
+        config = SAConfig()
+    if config.mode not in PARALLEL_MODES:
+        raise ValueError(f'Unknown parallel mode {config.mode}, expected one of {PARALLEL_MODES}')
+    begin = perf_counter()
+    chains = max(1, config.chains)
+    seeds = np.random.SeedSequence(config.seed).spawn(chains + 1)
+    rng = np.random.default_rng(seeds[-1])
+    evaluator = get_evaluator(G)
+    tempering = config.mode == 'tempering'
+
+    """
+    Initial placements and temperatures
+    """
+
+    states = [random_placement(G, N, rng) for _ in range(chains)]
+    T0 = config.initial_temperature
+    if T0 is None:
+        on, off = free_arcs(G, states[0])
+        if not on or not off:
+            return anneal(G, N, config, states[0])
+        T0 = initial_temperature(IncrementalENS(evaluator, states[0]), on, off, config.initial_acceptance, rng)
+    # one temperature per chain from T0 down to the final temperature when tempering
+    ladder = T0 * config.final_ratio ** (np.arange(chains) / max(1, chains - 1))
+    current = evaluator.evaluate(np.array(states)).ens + G.get_ens_lower_bound()
+
+    best = np.inf
+    best_X = None
+    best_chain = 0
+    stats = [{'chain' : c, 'temperature' : float(ladder[c]) if tempering else T0, 'iterations' : 0,
+        'accepted' : 0, 'improved' : 0, 'best_obj' : np.inf, 'time' : 0.0, 'exchanges' : 0, 'restarts' : 0}
+        for c in range(chains)]
+    energies = [[] for _ in range(chains)]
+    temperatures = [[] for _ in range(chains)]
+
+    """
+    Epochs
+    """
+
+    executor = None
+    if config.max_workers != 1:
+        source = getattr(G, 'cache_file', None)
+        if source is None or not os.path.isfile(source):
+            source = G.arrays()
+        executor = ProcessPoolExecutor(max_workers=config.max_workers,
+            initializer=_set_worker_graph, initargs=(source,))
+    try:
+        k = 0
+        epoch = 0
+        while k < config.iterations:
+            stop = min(k + config.exchange_every, config.iterations)
+            tasks = []
+            for c in range(chains):
+                seed = seeds[c].spawn(1)[0]
+                if tempering:
+                    chain_config = replace(config, initial_temperature=float(ladder[c]),
+                        final_ratio=1.0, iterations=stop - k, seed=seed)
+                    tasks.append((N, chain_config, states[c], 0, stop - k))
+                else:
+                    chain_config = replace(config, initial_temperature=T0, seed=seed)
+                    tasks.append((N, chain_config, states[c], k, stop))
+            if executor is None:
+                results = [anneal(G, *task) for task in tasks]
+            else:
+                results = list(executor.map(_run_worker_chain, tasks))
+
+            for c, result in enumerate(results):
+                chain = stats[c]
+                for name in ('iterations', 'accepted', 'improved', 'time'):
+                    chain[name] += result.stats.get(name, 0)
+                chain['best_obj'] = min(chain['best_obj'], result.obj)
+                energies[c].extend(result.energies)
+                temperatures[c].extend(result.temperatures)
+                states[c] = result.current
+                current[c] = result.stats.get('current_obj', result.obj)
+                if result.obj < best:
+                    best, best_X, best_chain = result.obj, result.placement, c
+
+            if tempering:
+                # swap placements of neighbouring temperatures, even and odd pairs in turn
+                for c in range(epoch % 2, chains - 1, 2):
+                    exponent = (current[c] - current[c + 1]) * (1 / ladder[c] - 1 / ladder[c + 1])
+                    if exponent >= 0 or rng.random() < exp(exponent):
+                        states[c], states[c + 1] = states[c + 1], states[c]
+                        current[[c, c + 1]] = current[[c + 1, c]]
+                        stats[c]['exchanges'] += 1
+                        stats[c + 1]['exchanges'] += 1
+            elif stop < config.iterations:
+                # the worst chain continues from the best placement found so far
+                worst = int(np.argmax(current))
+                if current[worst] > best:
+                    states[worst] = best_X.copy()
+                    current[worst] = best
+                    stats[worst]['restarts'] += 1
+            k = stop
+            epoch += 1
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = perf_counter() - begin
+    iterations = sum(chain['iterations'] for chain in stats)
+    total = {
+        'iterations' : iterations,
+        'chains' : chains,
+        'epochs' : epoch,
+        'accepted' : sum(chain['accepted'] for chain in stats),
+        'improved' : sum(chain['improved'] for chain in stats),
+        'exchanges' : sum(chain['exchanges'] for chain in stats) // 2 if tempering else
+            sum(chain['restarts'] for chain in stats),
+        'initial_temperature' : T0,
+        'time' : elapsed,
+        'moves_per_second' : iterations / elapsed if elapsed > 0 else 0.0
+    }
+    return SAResult(best_X, best, total, energies[best_chain], temperatures[best_chain],
+        states[best_chain], stats)
@@ -0,0 +1,167 @@
+"""
+This module contains scaling benchmarks for the data structures in util.py.
+Run from the parent directory, like the other scripts.
+"""
+
+import numpy as np
+import pandas
+from math import floor
+from time import perf_counter
+from reader import Node, Edge, Info
+from util import Graph
+from cache import load_graph_object
+from ens import get_evaluator
+
+def random_radial_info(n_nodes : int, n_substations : int = 10,
+        chain_probability : float = 0.9, seed : int = 0) -> Info:
+    """
+    Builds a random radial network with the same record layout as a .switch file.\\
+    n_nodes : number of nodes including substations\\
+    n_substations : number of substations, nodes 1..n_substations\\
+    chain_probability : probability a node attaches to the previous node,
+    higher values give deeper trees like generate_similar_graph\\
+    seed : seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0, 0.25, n_nodes)
+    power = rng.uniform(40, 420, n_nodes)
+
+    nodes = [Node(i, 0, 0, -1) for i in range(1, n_substations + 1)]
+    nodes += [
+        Node(i, float(theta[i - 1]), float(power[i - 1]), 1)
+        for i in range(n_substations + 1, n_nodes + 1)
+    ]
+
+    chain = rng.random(n_nodes) < chain_probability
+    earlier = (rng.random(n_nodes) * np.arange(n_nodes)).astype(np.int64) + 1
+    edges = []
+    for i in range(n_substations + 1, n_nodes + 1):
+        parent = i - 1 if chain[i - 1] else int(earlier[i - 1])
+        edges.append(Edge(parent, i))
+    return Info(n_nodes, len(edges), 0, nodes, edges, [], [])
+
+def benchmark_preprocessing(sizes : list[int] = [10**3, 10**4, 10**5, 10**6]) -> pandas.DataFrame:
+    """
+    Times Graph construction and the interval based queries for increasing
+    network sizes.
+    """
+    dict_df = {
+        'nodes' : [],
+        'build' : [],
+        'build_per_node' : [],
+        'bytes_per_node' : [],
+        'load_queries' : [],
+        'descendant_queries' : []
+    }
+
+    for n in sizes:
+        info = random_radial_info(n)
+
+        start = perf_counter()
+        G = Graph(info)
+        build = perf_counter() - start
+
+        start = perf_counter()
+        for i in G.V:
+            G.downstream_load[i]
+        load_queries = perf_counter() - start
+
+        start = perf_counter()
+        for i in G.V:
+            G.descendants(i).size
+        descendant_queries = perf_counter() - start
+
+        dict_df['nodes'].append(n)
+        dict_df['build'].append(build)
+        dict_df['build_per_node'].append(build / n)
+        dict_df['bytes_per_node'].append(
+            sum(x.nbytes for x in vars(G).values() if isinstance(x, np.ndarray)) / n)
+        dict_df['load_queries'].append(load_queries)
+        dict_df['descendant_queries'].append(descendant_queries)
+
+    return pandas.DataFrame(dict_df)
+
+def _legacy_cut(G : Graph, subtree : tuple[tuple[int, int]], 
+        XV : dict[tuple[int, int], int]) -> tuple[float, dict[tuple[int, int], float]]:
+    """
+    Cut of a subtree as the Benders callback computed it before ENSEvaluator.subtree_cut,
+    the ENS of the subtree is recomputed recursively with a switch added on each arc in turn.
+    """
+    def downstream_theta(i, j, memo):
+        if (i, j) not in memo:
+            memo[i, j] = (1 - XV[i, j]) * (G.theta[j] + 
+                sum(downstream_theta(j, k, memo) for k in G.outgoing[j]))
+        return memo[i, j]
+
+    def calculate_ENS():
+        memo = dict()
+        return sum((G.downstream_load[i] - G.downstream_load[j]) * downstream_theta(i, j, memo) 
+            for i, j in subtree)
+
+    ENS = calculate_ENS()
+    Savings = {}
+    for i, j in subtree:
+        XV[i, j] = 1
+        Savings[i, j] = ENS - calculate_ENS()
+        XV[i, j] = 0
+    return ENS, Savings
+
+def benchmark_cut_generation(file_number : int = 7, nodes_factor : int = 1, P : float = 0.4,
+        placements : int = 20, seed : int = 0) -> pandas.DataFrame:
+    """
+    Times the cut generation of the Benders callback (ENS and savings of every
+    subtree of an incumbent) before and after ENSEvaluator.subtree_cut, on random
+    placements. Also reports the largest difference between the two cuts.
+    """
+    G = load_graph_object(file_number, nodes_factor > 1, nodes_factor)
+    evaluator = get_evaluator(G)
+    A = G.edges
+    rng = np.random.default_rng(seed)
+    free = np.flatnonzero(G.tail != 0)
+    n_switches = floor(P * len(A))
+
+    before = after = 0
+    subtree_count = 0
+    max_difference = 0
+    for _ in range(placements):
+        xv = (G.tail == 0).astype(np.float64)
+        xv[rng.choice(free, size=n_switches, replace=False)] = 1
+        XV = dict(zip(A, xv.astype(int).tolist()))
+        subtrees = G.get_subtrees(XV)
+        subtree_count += len(subtrees)
+
+        start = perf_counter()
+        legacy = [_legacy_cut(G, subtree, XV) for subtree in subtrees]
+        before += perf_counter() - start
+
+        start = perf_counter()
+        F = evaluator.evaluate(xv).F
+        cuts = [evaluator.subtree_cut([A.index(a) for a in subtree], F) for subtree in subtrees]
+        after += perf_counter() - start
+
+        for subtree, (ENS, Savings), (new_ENS, new_savings) in zip(subtrees, legacy, cuts):
+            max_difference = max(max_difference, abs(ENS - new_ENS),
+                max(abs(Savings[a] - x) for a, x in zip(subtree, new_savings.tolist())))
+
+    return pandas.DataFrame({
+        'file_number' : [file_number],
+        'nodes_factor' : [nodes_factor],
+        'arcs' : [len(A)],
+        'subtrees_per_placement' : [subtree_count / placements],
+        'before' : [before / placements],
+        'after' : [after / placements],
+        'speedup' : [before / after],
+        'max_difference' : [max_difference]
+    })
+
+if __name__ == "__main__":
+    df = benchmark_preprocessing()
+    print(df)
+    df.to_csv('outputs/bench_preprocessing.csv', index=False)
+
+    df = pandas.concat([
+        benchmark_cut_generation(7, 1),
+        benchmark_cut_generation(7, 10, placements=5)
+    ])
+    print(df)
+    df.to_csv('outputs/bench_cut_generation.csv', index=False)
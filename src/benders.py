@@ -1,170 +1,344 @@
 import gurobipy as gp
-from util import Graph
-from math import floor
+import numpy as np
+from util import Sectors
+from ens import get_evaluator
+from time import perf_counter
 from params import ModelParams, ModelOutput
+from formulation import BuiltModel, build_switch_model, set_mip_start
+from timing import PhaseTimer
+from warmstart import switch_budget, warm_start_placement
+from lagrangian import lagrangian_bound
 
-def run_benders(params : ModelParams) -> ModelOutput:
+def build_benders(params : ModelParams) -> BuiltModel:
     """
-    Runs Benders optimization for given parameters.\\
+    Builds the Benders master problem of params.G. The model only depends on P
+    through the right-hand side of the max switches constraint, which
+    solve_benders sets, so it can be solved for several P.
+    """
+    G = params.G
+    # big M of the slack coupling, the sum of theta bounds every flow
+    M = float(G.theta_array[G.vertices].sum())
+    return build_switch_model(G, switch_budget(G, params.P), M)
+
+def solve_benders(built : BuiltModel, params : ModelParams, placement : np.ndarray = None) -> ModelOutput:
     """
-    
+    Solves a master problem from build_benders for params.P.\\
+    placement : placement vector to warm start from, by default the warm start of params
+    """
+
     """
     Setup
     """
-    
+
     G = params.G
     verbal = params.verbal
     presolve = params.do_presolve
     time_limit = params.time_limit
-    m = gp.Model()
-
-    """
-    Sets
-    """
-
-    V = G.V
+    m, X, F, FSlack = built.m, built.X, built.F, built.FSlack
     A = G.edges
+    N = switch_budget(G, params.P)
+    built.max_switches.RHS = N
+    Elb = G.get_ens_lower_bound()
+    Eub = G.get_ens_upper_bound()
+    # a model solved for several P is built once, the build is reported by its first solve
+    build_time = None if built.solves else built.build_time
+    built.solves += 1
+    timer = PhaseTimer(params.phases)
+    if build_time is not None:
+        timer.add('build', build_time)
 
     """
-    Data
+    Warm start
     """
 
-    P = params.P
-    N = floor(P * len(A)) + len(G.substations)# Maximum number of switches that can be placed, including mandatory between substations and root
-    Elb = G.get_ens_lower_bound()
-    Eub = G.get_ens_upper_bound()
+    warm_start_time = perf_counter()
+    evaluator = get_evaluator(G)
+    pool = params.cut_pool
+    if placement is None:
+        placement = warm_start_placement(params)
+    cutoff = gp.GRB.INFINITY
+    lower_bound = None
+    if params.lagrangian:
+        bound = lagrangian_bound(G, N)
+        # solutions worse than the repaired Lagrangian placement are cut off
+        cutoff = bound.upper_bound + params.FeasibilityTol * max(1.0, abs(bound.upper_bound))
+        lower_bound = bound.lower_bound
+        if placement is None:
+            placement = bound.placement
+        if verbal:
+            print(f'Lagrangian bound: {bound.lower_bound}, placement ENS: {bound.upper_bound}, gap {bound.gap:.3%}')
+    if placement is not None:
+        start_obj = set_mip_start(G, placement, X, F, FSlack)
+        if params.warm_start_cuts:
+            pool.add_placement(evaluator, placement)
+        if verbal:
+            print('Warm start ENS:', start_obj)
+
+    # Cuts found by earlier runs on this graph, that are not in the model yet
+    built.cuts |= pool.add_to_model(m, G, X, F, skip = built.cuts)
+    timer.add('warm_start', perf_counter() - warm_start_time)
 
     """
-    Variables
+    Optimize + Output
     """
+    trace = [] if params.trace else None
+    start_time = perf_counter()
 
-    X = { # Assignment of switch on arc (i, j)
-        (i, j) : m.addVar(vtype=gp.GRB.BINARY)
-        for i, j in A
-    }
+    X_list = list(X.values())
+    F_list = list(F.values())
 
-    F = { # Duration of interruption on arc (i, j)
-        (i, j) : m.addVar(lb = 0)
-        for i, j in A
-    }
+    def cut_constraint(arcs : np.ndarray, ENS : float, Savings : np.ndarray,
+            X : dict[tuple[int, int], gp.Var] = X, F : dict[tuple[int, int], gp.Var] = F) -> gp.TempConstr:
+        subtree = [A[a] for a in arcs.tolist()]
+        return (gp.quicksum(
+            (G.downstream_load[i] - G.downstream_load[j]) * F[i, j] for i, j in subtree) >= 
+                    ENS - 
+                    gp.quicksum(
+                        s * X[a] for a, s in zip(subtree, Savings.tolist())
+                    )
+        )
 
-    FSlack = { # Slack variable
-        j : m.addVar(lb = 0)
-        for j in V
-    }
+    def get_cut(sectors : Sectors, s : int, key : tuple[int, frozenset[int]], 
+            result) -> tuple[np.ndarray, float, np.ndarray, bool]:
+        # cut of sector s from the pool, computed from the placement on a miss
+        cut = pool.get(key)
+        if cut is not None:
+            return *cut, False
+        arcs = sectors.arcs_of(s)
+        cut = (arcs, *evaluator.subtree_cut(arcs, result.F))
+        pool.add(key, *cut)
+        return *cut, True
 
-    """
-    Objective
-    """
+    def violated_cuts(point : np.ndarray, x : np.ndarray, f : np.ndarray) -> tuple[list, int, int]:
+        """
+        Returns the subtree cuts violated by the relaxed solution (x, f), most
+        violated first with their pool keys, with the amount of sectors and of new cuts. The cuts are
+        taken from the placement switching the N arcs with the largest value in
+        point that are at least params.cut_threshold.
+        """
+        chosen = np.argsort(-point, kind='stable')[:N]
+        chosen = chosen[point[chosen] >= params.cut_threshold]
+        xv = np.zeros(len(A))
+        xv[chosen] = 1
+        result = evaluator.evaluate(xv)
+        sectors = G.get_sectors(xv)
 
-    m.setObjective(
-        gp.quicksum((G.downstream_load[i] - G.downstream_load[j]) * F[i, j] for i, j in A) + Elb,
-        gp.GRB.MINIMIZE
-    )
+        candidates = []
+        cuts_added = 0
+        for s, key in enumerate(evaluator.sector_keys(sectors, xv)):
+            arcs, ENS, Savings, new = get_cut(sectors, s, key, result)
+            cuts_added += new
+            violation = ENS - np.dot(Savings, x[arcs]) - np.dot(evaluator.weight[arcs], f[arcs])
+            if violation > 1e-6 * max(1, ENS):
+                candidates.append((violation, key, arcs, ENS, Savings))
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return candidates, len(sectors), cuts_added
 
-    """
-    Constraints
-    """
+    def separate(model : gp.Model) -> None:
+        """
+        Adds subtree cuts violated by the node relaxation as user cuts.
+        """
+        time_0 = perf_counter()
+        x = np.array(model.cbGetNodeRel(X_list))
+        f = np.array(model.cbGetNodeRel(F_list))
+        candidates, sector_count, cuts_added = violated_cuts(x, x, f)
+        for _, _, arcs, ENS, Savings in candidates[:params.max_node_cuts]:
+            model.cbCut(cut_constraint(arcs, ENS, Savings))
 
-    # We must place switch between root and substation for all substations
-    SwitchesBetweenRootAndSubstation = {
-        (0, j) :
-        m.addConstr(X[0, j] == 1)
-        for j in V if (0, j) in A
-    }
+        if trace is not None:
+            trace.append({
+                'callback' : len(trace),
+                'where' : 'MIPNODE',
+                'wall_time' : perf_counter() - start_time,
+                'runtime' : model.cbGet(gp.GRB.Callback.RUNTIME),
+                'node' : model.cbGet(gp.GRB.Callback.MIPNODE_NODCNT),
+                'best' : model.cbGet(gp.GRB.Callback.MIPNODE_OBJBST),
+                'bound' : model.cbGet(gp.GRB.Callback.MIPNODE_OBJBND),
+                'subtrees' : sector_count,
+                'new_cuts' : cuts_added,
+                'violated_cuts' : len(candidates),
+                'user_cuts' : min(len(candidates), params.max_node_cuts),
+                'callback_time' : perf_counter() - time_0
+            })
 
-    # Number of switches <= Max switches
-    MaxSwitches = m.addConstr(gp.quicksum(X[i, j] for (i, j) in A) <= N)
+    def root_cut_loop() -> tuple[float, float]:
+        """
+        Solves the LP relaxation of the master and adds its violated subtree cuts
+        to both models until the bound stalls. Cuts are separated at a point
+        between the LP solution and a core point (in-out stabilization), and at
+        the LP solution itself when that point gives no violated cut. The core
+        point moves halfway to each LP solution.\\
+        Returns the time taken and the bound reached.
+        """
+        time_0 = perf_counter()
+        m.update()
+        relaxed = m.relax()
+        relaxed.setParam('OutputFlag', 0)
+        variables = relaxed.getVars()
+        relaxed_X = {a : variables[X[a].index] for a in A}
+        relaxed_F = {a : variables[F[a].index] for a in A}
 
-    theta_sum = sum([v for v in G.theta.values()])
-    M = theta_sum * G.downstream_load[0]
+        # core point, the warm start or the switches spread over the free arcs
+        forced = (G.tail == 0)
+        if placement is not None:
+            core = placement.copy()
+        else:
+            core = np.where(forced, 1, (N - forced.sum()) / max(1, len(A) - forced.sum()))
 
-    Equality = {
-        (i, j) :
-        m.addConstr(F[i, j] + FSlack[j] == G.theta[j] + gp.quicksum(F[j, k] for k in G.outgoing[j]))
-        for i, j in A
-    }
+        alpha = params.stabilization
+        bound = -np.inf
+        stalled = 0
+        for _ in range(params.root_cut_rounds):
+            relaxed.optimize()
+            if relaxed.Status != gp.GRB.OPTIMAL:
+                break
+            improvement = relaxed.ObjVal - bound
+            bound = relaxed.ObjVal
+            stalled = stalled + 1 if improvement < params.root_stall_tolerance * max(1, abs(bound)) else 0
+            if stalled >= params.root_stall_rounds:
+                break
 
-    M = theta_sum
-    Slack = {
-        (i, j) :
-        m.addConstr(FSlack[j] <= M * X[i, j])
-        for i, j in A
-    }
+            x = np.array(relaxed.getAttr('X', list(relaxed_X.values())))
+            f = np.array(relaxed.getAttr('X', list(relaxed_F.values())))
+            candidates = violated_cuts(alpha * x + (1 - alpha) * core, x, f)[0]
+            if not candidates:
+                candidates = violated_cuts(x, x, f)[0]
+            if not candidates:
+                break
+            for _, key, arcs, ENS, Savings in candidates[:params.max_node_cuts]:
+                relaxed.addConstr(cut_constraint(arcs, ENS, Savings, relaxed_X, relaxed_F))
+                # the master keeps its cuts for later solves, see BuiltModel.cuts
+                if key not in built.cuts:
+                    m.addConstr(cut_constraint(arcs, ENS, Savings))
+                    built.cuts.add(key)
+            core = (core + x) / 2
+        return perf_counter() - time_0, bound
 
-    """
-    Optimize + Output
-    """
-    _searched_subtrees = dict()
-    _ENS = dict()
+    node_rounds = {'node' : -1, 'rounds' : 0}
     def Callback(model : gp.Model, where : int):
-        if where == gp.GRB.Callback.MIPSOL:
+        if where == gp.GRB.Callback.MIPNODE and params.max_cut_rounds > 0:
+            if model.cbGet(gp.GRB.Callback.MIPNODE_STATUS) != gp.GRB.OPTIMAL:
+                return
+            node = model.cbGet(gp.GRB.Callback.MIPNODE_NODCNT)
+            if node >= params.max_cut_nodes:
+                return
+            if node != node_rounds['node']:
+                node_rounds['node'] = node
+                node_rounds['rounds'] = 0
+            if node_rounds['rounds'] < params.max_cut_rounds:
+                node_rounds['rounds'] += 1
+                separate(model)
+
+        elif where == gp.GRB.Callback.MIPSOL:
+            time_0 = perf_counter()
             XV = model.cbGetSolution(X)
             XV = {x : round(XV[x]) for x in XV}
-            subtrees = G.get_subtrees(XV)
+            xv = evaluator.placement(XV)
+            result = evaluator.evaluate(xv)
+            time_1 = perf_counter()
+            # sectors unchanged since an earlier incumbent are found in the pool by key
+            sectors = G.get_sectors(xv)
+            keys = evaluator.sector_keys(sectors, xv)
+            time_2 = perf_counter()
 
             cuts_added = 0
+            cut_time = lazy_time = 0
 
-            for subtree in subtrees:
-                if subtree not in _ENS:
-                    _ENS[subtree] = G.calculate_ENS(subtree, XV)
-                    cuts_added += 1
-                ENS = _ENS[subtree]
-
-                Savings = {}
-                if subtree not in _searched_subtrees:
-                    for i, j in subtree:
-                        XV[i, j] = 1
-                        Savings[i, j] = ENS - G.calculate_ENS(subtree, XV)
-                        XV[i, j] = 0
-                    _searched_subtrees[subtree] = Savings
-                Savings = _searched_subtrees[subtree]
+            for s, key in enumerate(keys):
+                time_3 = perf_counter()
+                arcs, ENS, Savings, new = get_cut(sectors, s, key, result)
+                cuts_added += new
+                time_4 = perf_counter()
 
                 try:
-                    model.cbLazy(gp.quicksum(
-                        (G.downstream_load[i] - G.downstream_load[j]) * F[i, j] for i, j in subtree) >= 
-                                ENS - 
-                                gp.quicksum(
-                                    Savings[i, j] * X[i, j] for i, j in subtree
-                                )
-                    )
+                    model.cbLazy(cut_constraint(arcs, ENS, Savings))
                 except:
                     print('Constraint adding failed. Clancys fault.')
                     quit()
-            
+                cut_time += time_4 - time_3
+                lazy_time += perf_counter() - time_4
+
+            if trace is not None:
+                trace.append({
+                    'callback' : len(trace),
+                    'where' : 'MIPSOL',
+                    'wall_time' : perf_counter() - start_time,
+                    'runtime' : model.cbGet(gp.GRB.Callback.RUNTIME),
+                    'incumbent' : model.cbGet(gp.GRB.Callback.MIPSOL_OBJ),
+                    'best' : model.cbGet(gp.GRB.Callback.MIPSOL_OBJBST),
+                    'bound' : model.cbGet(gp.GRB.Callback.MIPSOL_OBJBND),
+                    'ens' : float(result.ens) + Elb,
+                    'subtrees' : len(sectors),
+                    'new_cuts' : cuts_added,
+                    'cached_cuts' : len(sectors) - cuts_added,
+                    'evaluate_time' : time_1 - time_0,
+                    'subtrees_time' : time_2 - time_1,
+                    'cut_time' : cut_time,
+                    'lazy_time' : lazy_time,
+                    'callback_time' : perf_counter() - time_0
+                })
             
             if verbal:
                 print('------------')
-                print('Current ENS:', G.calculate_ENS(A, XV) + Elb)
-                print('Average subtree length:', sum(len(subtree) for subtree in subtrees) / len(subtrees))
+                print('Current ENS:', result.ens + Elb)
+                print('Average subtree length:', len(sectors.arcs) / len(sectors))
                 print(f'X used: {sum(XV.values())}, X Available: {N}')
                 print(f'Cuts added: {cuts_added}')
-                print(f'Total cuts: {len(_searched_subtrees)}')
+                print(f'Total cuts: {len(pool)}')
+                print(f"Cut pool hit rate: {pool.stats()['hit_rate']:.3f}, evictions: {pool.evictions}")
                 print()
 
     m.setParam('OutputFlag', 0)
     m.setParam('MIPGap', params.MIPGap)
     m.setParam('LazyConstraints', 1)
+    if params.max_cut_rounds > 0:
+        m.setParam('PreCrush', 1)
     m.setParam('FeasibilityTol', params.FeasibilityTol)
     m.setParam('OptimalityTol', params.OptimalityTol)
     m.setParam('Seed', params.gurobi_seed)
+    m.setParam('Cutoff', cutoff)
     if not presolve:
         m.setParam('Presolve', 0)
 
     if time_limit:
         m.setParam('TimeLimit', 600)
-    m.optimize(Callback)
+    root_time = root_bound = None
+    if params.root_cut_rounds > 0:
+        root_time, root_bound = root_cut_loop()
+        timer.add('root', root_time)
+        if verbal:
+            print(f'Root cut loop: bound {root_bound} in {root_time} seconds')
+
+    with timer.phase('solve'):
+        m.optimize(Callback)
+
+    if params.cut_pool_path is not None:
+        with timer.phase('save_cuts'):
+            pool.save(params.cut_pool_path)
 
     if verbal:
         print('ENS', m.ObjVal)
         print('LB:', Elb)
         print('UB', Eub)
 
-    output = ModelOutput(m.ObjVal, 
-        {x : round(X[x].X) for x in X}, 
-        {x : F[x].X for x in F},
-        {x : FSlack[x].X for x in FSlack},
-        m.Runtime,
-        m.MIPGap
-    )
-    return output
\ No newline at end of file
+    with timer.phase('extract'):
+        output = ModelOutput(m.ObjVal, 
+            {x : round(X[x].X) for x in X}, 
+            {x : F[x].X for x in F},
+            {x : FSlack[x].X for x in FSlack},
+            m.Runtime,
+            m.MIPGap,
+            trace,
+            root_time,
+            root_bound,
+            build_time
+        )
+    output.phases = timer.result()
+    output.lower_bound = lower_bound
+    return output
+
+def run_benders(params : ModelParams) -> ModelOutput:
+    """
+    Runs Benders optimization for given parameters.\\
+    """
+    return solve_benders(build_benders(params), params)
\ No newline at end of file
@@ -0,0 +1,254 @@
+"""
+This module contains the on-disk cache of preprocessed Graph objects.
+Entries are keyed by the contents of the source .switch file, the generator
+parameters and the version of the code that builds the graph, so edited
+networks and generated networks are never served stale.
+
+Graphs are stored in a versioned binary format: an 8 byte magic string, a
+little-endian uint32 format version and uint32 header length, a JSON header
+listing the dtype, shape and offset of each array, then the raw arrays
+aligned to 64 bytes. Reading memory-maps the arrays, so processes loading
+the same file share one physical copy through the page cache.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import numpy as np
+import reader
+import util
+import generate
+from util import Graph
+from reader import read_switch_arrays
+from generate import generate_similar_graph
+from timing import PhaseTimer
+
+# Bump when the cached representation changes without a source change
+CACHE_VERSION = 2
+
+GRAPH_FILE_MAGIC = b'SWGRAPH\0'
+GRAPH_FILE_VERSION = 1
+_ALIGNMENT = 64
+
+def write_graph_file(G : Graph, filename : str) -> None:
+    """
+    Writes the arrays of graph to filename in the binary graph format.
+    """
+    arrays = {name : np.ascontiguousarray(x) for name, x in G.arrays().items()}
+    header = {}
+    offset = 0
+    for name, x in arrays.items():
+        header[name] = {'dtype' : x.dtype.str, 'shape' : list(x.shape), 'offset' : offset}
+        offset += -(-x.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps(header).encode()
+
+    # arrays start at the first aligned position after the header
+    start = len(GRAPH_FILE_MAGIC) + 8 + len(header)
+    padding = -start % _ALIGNMENT
+    with open(filename, 'wb') as file:
+        file.write(GRAPH_FILE_MAGIC)
+        file.write(struct.pack('<II', GRAPH_FILE_VERSION, len(header) + padding))
+        file.write(header + b' ' * padding)
+        for x in arrays.values():
+            file.write(x.tobytes())
+            file.write(b'\0' * (-x.nbytes % _ALIGNMENT))
+
+def read_graph_file(filename : str) -> Graph:
+    """
+    Memory-maps a file written by write_graph_file into a read-only Graph.
+    Raises ValueError if the file is not in the current format.
+    """
+    with open(filename, 'rb') as file:
+        magic = file.read(len(GRAPH_FILE_MAGIC))
+        if magic != GRAPH_FILE_MAGIC:
+            raise ValueError(f'{filename} is not a graph file')
+        version, header_length = struct.unpack('<II', file.read(8))
+        if version != GRAPH_FILE_VERSION:
+            raise ValueError(f'{filename} has graph file version {version}, expected {GRAPH_FILE_VERSION}')
+        header = json.loads(file.read(header_length))
+    start = len(GRAPH_FILE_MAGIC) + 8 + header_length
+
+    arrays = {}
+    for name, entry in header.items():
+        shape = tuple(entry['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.empty(shape, dtype=entry['dtype'])
+            continue
+        arrays[name] = np.memmap(filename, dtype=entry['dtype'], mode='r',
+            offset=start + entry['offset'], shape=shape)
+    return Graph.from_arrays(arrays)
+
+def _code_version() -> str:
+    """
+    Hash of the modules that read, preprocess and generate graphs.
+    """
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for module in (reader, util, generate):
+        with open(module.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+class GraphCache:
+    """
+    Content-addressed cache of preprocessed graphs stored in a directory.\\
+    Least recently used entries are removed once the directory holds more
+    than max_bytes of cached graphs.
+    """
+    def __init__(self, directory : str = 'graphs', max_bytes : int = 512 * 2**20) -> None:
+        """
+        directory : where cached graphs are stored\\
+        max_bytes : size limit of the cached graphs on disk
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._code_version = None
+
+    def key(self, networkfile : str, make_similar_graph : bool = False,
+            nodes_factor : int = 1, seed : int = 0) -> str:
+        """
+        Returns the cache key of a graph.\\
+        networkfile : path of the .switch file the graph is read from\\
+        make_similar_graph, nodes_factor, seed : generator parameters, see ModelParams
+        """
+        if self._code_version is None:
+            self._code_version = _code_version()
+        digest = hashlib.sha256(self._code_version.encode())
+        with open(networkfile, 'rb') as file:
+            digest.update(file.read())
+        if make_similar_graph:
+            digest.update(f'similar:{nodes_factor}:{seed}'.encode())
+        return digest.hexdigest()
+
+    def path(self, key : str) -> str:
+        return os.path.join(self.directory, f'{key}.graph')
+
+    def cut_pool_path(self, key : str) -> str:
+        """
+        Returns where the Benders cut pool of the graph with key is stored, see CutPool.
+        """
+        return os.path.join(self.directory, f'{key}.cuts.npz')
+
+    def get(self, key : str) -> Graph:
+        """
+        Returns the cached graph, or None if it is not cached.
+        """
+        filename = self.path(key)
+        if not os.path.isfile(filename):
+            self.misses += 1
+            return None
+        try:
+            G = read_graph_file(filename)
+        except ValueError:
+            os.remove(filename)
+            self.misses += 1
+            return None
+        # modification time records the last use for eviction
+        os.utime(filename)
+        self.hits += 1
+        return G
+
+    def put(self, key : str, G : Graph) -> None:
+        """
+        Stores graph under key, then evicts entries above the size limit.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.path(key)
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        write_graph_file(G, temporary)
+        os.replace(temporary, filename)
+        self.evict(keep = key)
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """
+        Returns (last use, size, path) of every cached graph, least recent first.
+        The size includes the cut pool stored next to the graph.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        output = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.graph'):
+                continue
+            filename = os.path.join(self.directory, name)
+            stat = os.stat(filename)
+            size = stat.st_size
+            cuts = filename[:-len('.graph')] + '.cuts.npz'
+            if os.path.isfile(cuts):
+                size += os.path.getsize(cuts)
+            output.append((stat.st_mtime, size, filename))
+        return sorted(output)
+
+    def evict(self, keep : str = None) -> None:
+        """
+        Removes least recently used entries until the cache fits in max_bytes.\\
+        keep : key that is never evicted
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in entries:
+            if total <= self.max_bytes:
+                break
+            if keep is not None and filename == self.path(keep):
+                continue
+            os.remove(filename)
+            # cut pools are only valid for their graph
+            cuts = filename[:-len('.graph')] + '.cuts.npz'
+            if os.path.isfile(cuts):
+                os.remove(cuts)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns hit/miss counts and the current size of the cache.
+        """
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : self.hits / lookups if lookups else 0,
+            'evictions' : self.evictions,
+            'entries' : len(entries),
+            'bytes' : sum(size for _, size, _ in entries)
+        }
+
+default_cache = GraphCache()
+
+def load_graph_object(file_number : int, make_similar_graph : bool = False,
+        nodes_factor : int = 1, seed : int = 0, cache : GraphCache = None,
+        timer : PhaseTimer = None) -> Graph:
+    """
+    Loads the graph of networks/R{file_number}.switch through the cache.\\
+    make_similar_graph : if true, generate a graph similar to the file, see generate_similar_graph\\
+    nodes_factor : multiplier of the amount of nodes of a generated graph\\
+    seed : seed of the generator\\
+    cache : GraphCache to use, the default cache stores graphs in graphs/\\
+    timer : if given, records reading files as 'load' and building graphs as 'preprocess'\\
+    The cache key is stored on the graph as G.cache_key and the cached file as G.cache_file.
+    """
+    if cache is None:
+        cache = default_cache
+    if timer is None:
+        timer = PhaseTimer()
+
+    networkfile = f'networks/R{file_number}.switch'
+    with timer.phase('load'):
+        key = cache.key(networkfile, make_similar_graph, nodes_factor, seed)
+        G = cache.get(key)
+    if G is None:
+        with timer.phase('load'):
+            arrays = read_switch_arrays(networkfile)
+        with timer.phase('preprocess'):
+            G = Graph.from_switch_arrays(arrays)
+            if make_similar_graph:
+                G = generate_similar_graph(G, nodes_factor, seed)
+        with timer.phase('load'):
+            cache.put(key, G)
+    G.cache_key = key
+    G.cache_file = cache.path(key)
+    return G
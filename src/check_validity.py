@@ -2,7 +2,10 @@
 import numpy as np
 from benders import run_benders
 from mip import run_mip
+from sa import run_sa
+from anneal import SAConfig
 from math import floor
+from ens import get_evaluator
 from params import ModelOutput, ModelParams
 
 def check_constraints(params:ModelParams, output:ModelOutput) -> bool:
@@ -18,13 +21,13 @@ def check_constraints(params:ModelParams, output:ModelOutput) -> bool:
 
     for i, j in FV:
         LHS = round(SlackV[j] + FV[i, j], 6)
-        RHS = round(G.theta[j] + sum([FV[j, k] for k in G.V if k in G.outgoing[j]]), 6)
+        RHS = round(G.theta[j] + sum([FV[j, k] for k in G.outgoing[j]]), 6)
         if LHS != RHS:
             print('---- constraint failure ----')
             print(i, j)
             print('Equality Constraint')
             print(LHS, RHS)
-            print(SlackV[j] + FV[i, j], G.theta[j] + sum([FV[j, k] for k in G.V if k in G.outgoing[j]]))
+            print(SlackV[j] + FV[i, j], G.theta[j] + sum([FV[j, k] for k in G.outgoing[j]]))
             print()
             violation = True
         if SlackV[j] > G.M * XV[i, j]:
@@ -33,7 +36,7 @@ def check_constraints(params:ModelParams, output:ModelOutput) -> bool:
             print(i, j)
             print('Slack Constraint')
             print('XV:', XV[i, j])
-            print('Slack', SlackV[j], 'F', FV[i, j], 'RHS', G.theta[j] + sum([FV[j, k] for k in G.V if k in G.outgoing[j]]))
+            print('Slack', SlackV[j], 'F', FV[i, j], 'RHS', G.theta[j] + sum([FV[j, k] for k in G.outgoing[j]]))
             print()
             violation = True
         if i == 0:
@@ -44,6 +47,17 @@ def check_constraints(params:ModelParams, output:ModelOutput) -> bool:
                 print(XV[i, j])
                 print()
                 violation = True
+
+    # Check objective against the ENS of the switch placement
+    evaluator = get_evaluator(G)
+    ENS = evaluator.evaluate(evaluator.placement(XV)).ens + G.get_ens_lower_bound()
+    if abs(output.obj - ENS) > 1e-6 * max(1, abs(ENS)):
+        print('---- constraint failure ----')
+        print('Objective')
+        print('Objective:', output.obj, 'ENS of placement:', ENS)
+        print()
+        violation = True
+
     if violation:
         print('Check showed violations of constraints.')
     else:
@@ -59,8 +73,15 @@ def check_solution():
     output = run_mip(params)
     check_constraints(params, output)
 
+def check_no_moves():
+    # P = 0 leaves only the switches between the root and the substations, SA has nothing to move
+    params = ModelParams(5, 0)
+    output = run_sa(params, SAConfig(seed=0))
+    check_constraints(params, output)
+
 def main():
     check_solution()
+    check_no_moves()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+"""
+This module contains the pool of Benders subtree cuts.
+
+A cut of subtree S states that the ENS on S is at least its ENS in the
+placement it was found in, minus the saving of each switch placed on S.
+Its coefficients only depend on the network, not on P, the seed or the time
+limit, so a pool collected while solving for one P stays valid for every
+other P on the same graph and can be stored next to the cached graph.
+
+Subtrees are keyed canonically by their top arc and the set of switched arcs
+on their boundary, see ENSEvaluator.sector_keys. The pool is bounded in
+memory and evicts the least recently used cuts first.
+"""
+
+import os
+import numpy as np
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from util import Graph
+from ens import ENSEvaluator
+
+if TYPE_CHECKING:
+    import gurobipy as gp
+
+# Approximate memory of a cut besides its arrays: dictionary entry, key and tuple
+_CUT_OVERHEAD = 256
+
+class CutPool:
+    """
+    Bounded LRU pool of Benders subtree cuts of one graph.\\
+    A cut is stored as (arcs, ENS, savings), with arcs the indexes into G.edges
+    of the subtree and savings the coefficient of each of its arcs.
+    """
+    def __init__(self, max_bytes : int = 64 * 2**20) -> None:
+        """
+        max_bytes : approximate memory limit of the stored cuts
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._cuts = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cuts)
+
+    def __contains__(self, key : tuple[int, frozenset[int]]) -> bool:
+        return key in self._cuts
+
+    @staticmethod
+    def _size(key : tuple[int, frozenset[int]], arcs : np.ndarray, savings : np.ndarray) -> int:
+        return _CUT_OVERHEAD + 8 * len(key[1]) + arcs.nbytes + savings.nbytes
+
+    def get(self, key : tuple[int, frozenset[int]]) -> tuple[np.ndarray, float, np.ndarray]:
+        """
+        Returns the cut of a subtree and marks it as recently used, or None
+        if the subtree has no cut.
+        """
+        cut = self._cuts.get(key)
+        if cut is None:
+            self.misses += 1
+            return None
+        self._cuts.move_to_end(key)
+        self.hits += 1
+        return cut
+
+    def add(self, key : tuple[int, frozenset[int]], arcs : np.ndarray,
+            ENS : float, savings : np.ndarray) -> None:
+        """
+        Adds the cut of a subtree, then evicts least recently used cuts above max_bytes.
+        """
+        if key in self._cuts:
+            return
+        arcs = np.asarray(arcs, dtype=np.int64)
+        savings = np.asarray(savings, dtype=np.float64)
+        self._cuts[key] = (arcs, ENS, savings)
+        self.nbytes += self._size(key, arcs, savings)
+
+        while self.nbytes > self.max_bytes and len(self._cuts) > 1:
+            old_key, (old_arcs, _, old_savings) = self._cuts.popitem(last=False)
+            self.nbytes -= self._size(old_key, old_arcs, old_savings)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns hit/miss counts, evictions and the current size of the pool.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits' : self.hits,
+            'misses' : self.misses,
+            'hit_rate' : self.hits / lookups if lookups else 0,
+            'evictions' : self.evictions,
+            'cuts' : len(self._cuts),
+            'bytes' : self.nbytes
+        }
+
+    def add_placement(self, evaluator : ENSEvaluator, X : np.ndarray) -> int:
+        """
+        Adds the cuts of every sector of a placement vector that is not in the
+        pool yet, and returns how many were added.
+        """
+        G = evaluator.G
+        sectors = G.get_sectors(X)
+        F = evaluator.evaluate(X).F
+        added = 0
+        for s, key in enumerate(evaluator.sector_keys(sectors, X)):
+            if key not in self._cuts:
+                arcs = sectors.arcs_of(s)
+                self.add(key, arcs, *evaluator.subtree_cut(arcs, F))
+                added += 1
+        return added
+
+    def add_to_model(self, m : 'gp.Model', G : Graph, X : dict[tuple[int, int], 'gp.Var'],
+            F : dict[tuple[int, int], 'gp.Var'], skip : set[tuple[int, frozenset[int]]] = None
+            ) -> set[tuple[int, frozenset[int]]]:
+        """
+        Adds the cuts of the pool to a Benders model as lazy constraints, and
+        returns their keys.\\
+        skip : keys of cuts that are already in the model
+        """
+        # only the Benders model needs Gurobi, the pool itself is shared with the heuristics
+        import gurobipy as gp
+        A = G.edges
+        added = set()
+        for key, (arcs, ENS, savings) in self._cuts.items():
+            if skip is not None and key in skip:
+                continue
+            subtree = [A[a] for a in arcs.tolist()]
+            constraint = m.addConstr(
+                gp.quicksum((G.downstream_load[i] - G.downstream_load[j]) * F[i, j] for i, j in subtree) >=
+                ENS - gp.quicksum(s * X[a] for a, s in zip(subtree, savings.tolist()))
+            )
+            constraint.Lazy = 1
+            added.add(key)
+        return added
+
+    def save(self, filename : str) -> None:
+        """
+        Writes the pool to filename as a .npz archive, least recently used cut first.
+        """
+        keys = list(self._cuts)
+        cuts = list(self._cuts.values())
+        lengths = [len(arcs) for arcs, _, _ in cuts]
+        boundary_lengths = [len(boundary) for _, boundary in keys]
+
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        temporary = f'{filename}.{os.getpid()}.tmp.npz'
+        np.savez(temporary,
+            top = np.array([top for top, _ in keys], dtype=np.int64),
+            boundary_offsets = np.concatenate(([0], np.cumsum(boundary_lengths, dtype=np.int64))),
+            boundary = np.array([a for _, boundary in keys for a in sorted(boundary)], dtype=np.int64),
+            offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+            arcs = np.concatenate([arcs for arcs, _, _ in cuts]) if cuts else np.zeros(0, dtype=np.int64),
+            ENS = np.array([ENS for _, ENS, _ in cuts], dtype=np.float64),
+            savings = np.concatenate([savings for _, _, savings in cuts]) if cuts else np.zeros(0)
+        )
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename : str, max_bytes : int = 64 * 2**20) -> 'CutPool':
+        """
+        Reads a pool written by save, an empty pool if filename does not exist
+        or was written in an older format.
+        """
+        pool = cls(max_bytes)
+        if not os.path.isfile(filename):
+            return pool
+        with np.load(filename) as data:
+            if 'top' not in data:
+                return pool
+            boundary_offsets = data['boundary_offsets'].tolist()
+            boundary = data['boundary'].tolist()
+            offsets = data['offsets'].tolist()
+            arcs = data['arcs']
+            savings = data['savings']
+            for c, (top, ENS) in enumerate(zip(data['top'].tolist(), data['ENS'].tolist())):
+                key = (top, frozenset(boundary[boundary_offsets[c]:boundary_offsets[c + 1]]))
+                start, end = offsets[c], offsets[c + 1]
+                pool.add(key, arcs[start:end], ENS, savings[start:end])
+        return pool
@@ -0,0 +1,185 @@
+"""
+This module contains run_dp, an exact solver of the switch placement problem
+that needs no Gurobi.
+
+The theta of node v is interrupted on every arc from v up to the nearest
+switched arc above it, so ENS is the sum over nodes of theta[v] times the
+weight of that path. On a radial network this gives a tree knapsack: the
+table of node v holds, for each ancestor t that can be the nearest switch
+above v and each number of switches k, the smallest ENS of the subtree of v.
+Tables of children are merged bottom-up by min-plus convolution, nodes are
+processed in post-order from a pre-order walk, so no recursion is needed, and
+the placement is recovered from the stored choices.
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from time import perf_counter
+from util import Graph
+from ens import get_evaluator
+from params import ModelOutput, ModelParams
+from timing import PhaseTimer
+from warmstart import switch_budget
+from sa import run_optimisation_fixed
+
+@dataclass
+class DPResult:
+    """
+    Stores the output of solve_dp\\
+    objs : objs[k] is the smallest ENS with at most k switches, including the ENS lower bound,
+    for k up to N (inf below the number of substations)\\
+    placement : optimal placement vector with at most N switches
+    """
+    objs : np.ndarray
+    placement : np.ndarray
+
+def _merge(A : np.ndarray, B : np.ndarray, size : int, dtype : np.dtype) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Min-plus convolution of the rows of A and B along the switch axis, cut
+    after size columns. Returns the result and the column of B of each entry, as dtype.
+    """
+    rows = A.shape[0]
+    length = min(A.shape[1] + B.shape[1] - 1, size)
+    result = np.full((rows, length), np.inf)
+    split = np.zeros((rows, length), dtype=dtype)
+    for j in range(min(B.shape[1], length)):
+        width = min(A.shape[1], length - j)
+        candidate = A[:, :width] + B[:, j:j + 1]
+        better = candidate < result[:, j:j + width]
+        result[:, j:j + width][better] = candidate[better]
+        split[:, j:j + width][better] = j
+    return result, split
+
+def solve_dp(G : Graph, N : int) -> DPResult:
+    """
+    Solves the placement of at most N switches exactly by dynamic programming
+    over the tree, for every budget up to N.\\
+    With n nodes, h the largest depth and tables cut after N + 1 columns, the
+    merges take O(n * h * N) time. The choices and splits kept for the
+    traceback take O(n * h * N) memory, with one byte per choice and the
+    smallest integer type holding N per split, while the tables of children
+    are freed once merged.\\
+    G : graph to place switches on\\
+    N : maximum number of switches, including the switches between the root and the substations
+    """
+    evaluator = get_evaluator(G)
+    prefix_weight = evaluator.prefix_weight
+    theta = G.theta_array.tolist()
+    parent = G.parent.tolist()
+    arc_id = G.arc_id.tolist()
+    children = G.children.tolist()
+    child_offsets = G.child_offsets.tolist()
+    size = N + 1
+    split_dtype = np.min_scalar_type(size)
+
+    # depth of each node below its substation, the depth of the arc into it
+    depth = np.zeros(len(parent), dtype=np.int64)
+    depth[G.head] = evaluator.depth
+    depth = depth.tolist()
+
+    """
+    Bottom-up
+    """
+
+    # table[v][i, k]: smallest ENS of the subtree of v with k switches on the arcs of
+    # the subtree and the arc into v, when the nearest switch above v is the ancestor at depth i
+    table = {}
+    choice = {}
+    splits = {}
+    root_children = []
+
+    # path[i]: prefix weight of the ancestor at depth i of the nodes on the stack
+    path = np.zeros(int(evaluator.depth.max()) + 1 if len(evaluator.depth) else 0)
+    stack = []
+
+    def process(v : int) -> None:
+        """
+        Merges the tables of the children of v into the table of v, path holds its ancestors.
+        """
+        d = depth[v]
+        # merged tables of the children, row d is the case of a switch on the arc into v
+        merged = np.zeros((d + 1, 1))
+        merges = []
+        for c in children[child_offsets[v]:child_offsets[v + 1]]:
+            merged, split = _merge(merged, table.pop(c), size, split_dtype)
+            merges.append((c, split))
+        splits[v] = merges
+
+        switched = np.full(min(merged.shape[1] + 1, size), np.inf)
+        switched[1:] = merged[d, :size - 1]
+        if parent[v] == 0:
+            # switches between the root and the substations are always placed
+            table[v] = switched[None, :]
+            choice[v] = None
+            root_children.append(v)
+            return
+        open_cost = theta[v] * (path[d] - path[:d])[:, None] + merged[:d]
+        opened = np.full((d, len(switched)), np.inf)
+        opened[:, :open_cost.shape[1]] = open_cost
+        choice[v] = switched[None, :] < opened
+        table[v] = np.where(choice[v], switched[None, :], opened)
+
+    # a node is processed once the walk leaves its subtree, after its children
+    for v in G.order.tolist():
+        if v == 0 or arc_id[v] < 0:
+            continue
+        d = depth[v]
+        while len(stack) > d:
+            process(stack.pop())
+        path[d] = prefix_weight[v]
+        stack.append(v)
+    while stack:
+        process(stack.pop())
+
+    # the substations are independent, the root merges their tables
+    total = np.zeros((1, 1))
+    root_merges = []
+    for s in root_children:
+        total, split = _merge(total, table.pop(s), size, split_dtype)
+        root_merges.append((s, split))
+    total = total[0]
+
+    objs = np.full(size, np.inf)
+    objs[:len(total)] = total
+    objs = np.minimum.accumulate(objs) + G.get_ens_lower_bound()
+
+    """
+    Traceback
+    """
+
+    X = np.zeros(len(G.head))
+    budget = int(np.argmin(total[:size]))
+    stack = []
+    for s, split in reversed(root_merges):
+        k = int(split[0, budget])
+        stack.append((s, 0, k))
+        budget -= k
+    while stack:
+        v, i, k = stack.pop()
+        if choice[v] is None or choice[v][i, k]:
+            X[arc_id[v]] = 1
+            row, k = depth[v], k - 1
+        else:
+            row = i
+        for c, split in reversed(splits[v]):
+            k_child = int(split[row, k])
+            stack.append((c, row, k_child))
+            k -= k_child
+    return DPResult(objs, X)
+
+def run_dp(params : ModelParams) -> ModelOutput:
+    """
+    Runs the exact dynamic programming solver for given parameters, see solve_dp.
+    """
+    G = params.G
+    P = params.P
+    timer = PhaseTimer(params.phases)
+    start = perf_counter()
+    with timer.phase('solve'):
+        result = solve_dp(G, switch_budget(G, P))
+    with timer.phase('extract'):
+        output = run_optimisation_fixed(G, P, dict(zip(G.edges, result.placement.astype(int).tolist())),
+            params.verbal)
+    output.time = perf_counter() - start
+    output.phases = timer.result()
+    return output
@@ -0,0 +1,355 @@
+"""
+This module contains the vectorized evaluation of energy not supplied (ENS)
+for switch placements on a radial network.
+
+The interruption flow on arc (i, j) is F[i, j] = (1 - X[i, j]) * (theta[j] + sum of F on arcs out of j),
+and ENS is the sum of (L_D[i] - L_D[j]) * F[i, j] over arcs. The theta of a
+node reaches an arc if no switch lies between them, that is if the node has as
+many switches above it as the head of the arc. Sums of theta are taken over
+the pre-order interval of each head among the nodes with that many switches,
+so evaluation needs no recursion, does not depend on the depth of the tree,
+and a batch of placements is evaluated at once.
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from util import Graph, Sectors
+
+@dataclass
+class ENSResult:
+    """
+    Stores the output of ENSEvaluator.evaluate, one row per placement
+    (no leading axis when a single placement was given).\\
+    ens : ENS of the placement, excluding the ENS lower bound\\
+    F : interruption flow on each arc\\
+    R : downstream theta of each arc, theta of the head plus F of the arcs out of it,
+    equal to F when the arc has no switch
+    """
+    ens : np.ndarray
+    F : np.ndarray
+    R : np.ndarray
+
+class ENSEvaluator:
+    """
+    Evaluates ENS and interruption flows of switch placements on a graph.\\
+    Placements are arrays in the order of G.edges, either a single vector of
+    length |A| or a (K, |A|) matrix of K placements.
+    """
+    def __init__(self, G : Graph) -> None:
+        self.G = G
+        # objective weight of each arc, L_D[i] - L_D[j]
+        self.weight = G.load_array[G.tail] - G.load_array[G.head]
+        self.theta = G.theta_array[G.head]
+
+        # depth of each arc, arcs out of the root have depth 0
+        parent_arc = G.arc_id[G.tail].tolist()
+        arc_id = G.arc_id.tolist()
+        depth = [0] * len(G.head)
+        for v in G.order.tolist():
+            a = arc_id[v]
+            if a >= 0 and parent_arc[a] >= 0:
+                depth[a] = depth[parent_arc[a]] + 1
+        self.depth = np.array(depth, dtype=np.int64)
+
+        # pre-order interval of the head of each arc and theta at each pre-order position
+        self._tin = G.tin[G.head]
+        self._tout = G.tout[G.head]
+        self._theta_position = np.zeros(len(G.order))
+        self._theta_position[self._tin] = self.theta
+
+        # sum of weights on the path from the root to each node, over pre-order intervals
+        difference = np.zeros(len(G.order) + 1)
+        np.add.at(difference, G.tin[G.head], self.weight)
+        np.subtract.at(difference, G.tout[G.head], self.weight)
+        self.prefix_weight = np.zeros(len(G.parent))
+        self.prefix_weight[G.order] = np.cumsum(difference[:-1])
+
+    def placement(self, XV : dict[tuple[int, int], float]) -> np.ndarray:
+        """
+        Converts a dictionary mapping arcs (i, j) -> {0,1} to a placement vector.
+        """
+        return np.fromiter((XV[a] for a in self.G.edges), dtype=np.float64, count=len(self.G.edges))
+
+    def evaluate(self, X : np.ndarray) -> ENSResult:
+        """
+        Evaluates one or a batch of placements, in O(K * |A| log(K * |A|)) for K placements.\\
+        X : binary placement vector or (K, |A|) matrix of placements
+        """
+        X = np.asarray(X, dtype=np.float64)
+        single = X.ndim == 1
+        X = np.atleast_2d(X)
+        K, n = X.shape
+        m = len(self.G.order)
+        tin, tout = self._tin, self._tout
+
+        # switches above each node, including the arc into it, by pre-order position
+        rows = np.arange(K)[:, None] * (m + 1)
+        difference = (np.bincount((rows + tin).ravel(), X.ravel(), K * (m + 1))
+            - np.bincount((rows + tout).ravel(), X.ravel(), K * (m + 1)))
+        switches = np.rint(np.cumsum(difference.reshape(K, m + 1), axis=1)[:, :m]).astype(np.int64)
+
+        # positions sorted by placement, amount of switches and pre-order, with the running sum of theta
+        stride = (n + 1) * (m + 1)
+        offset = np.arange(K)[:, None] * stride
+        keys = (offset + switches * (m + 1) + np.arange(m)).ravel()
+        by_key = np.argsort(keys)
+        keys = keys[by_key]
+        running = np.concatenate(([0.0], np.cumsum(np.tile(self._theta_position, K)[by_key])))
+
+        # theta of the nodes below the head of each arc with as many switches above them
+        level = offset + switches[:, tin] * (m + 1)
+        R = (running[np.searchsorted(keys, level + tout)]
+            - running[np.searchsorted(keys, level + tin)])
+        F = (1 - X) * R
+
+        result = ENSResult(
+            ens = F @ self.weight,
+            F = F,
+            R = R
+        )
+        if single:
+            result = ENSResult(result.ens[0], result.F[0], result.R[0])
+        return result
+
+    def slack(self, result : ENSResult) -> np.ndarray:
+        """
+        Returns the interruption slack of each node of a placement, indexed by
+        vertex: the downstream theta of the arc into the node minus its flow,
+        non-zero only when that arc has a switch, and 0 on nodes without an arc.\\
+        result : evaluate of a single placement
+        """
+        slack = np.zeros(len(self.G.parent))
+        slack[self.G.head] = result.R - result.F
+        return slack
+
+    def subtree_cut(self, arcs : np.ndarray, F : np.ndarray) -> tuple[float, np.ndarray]:
+        """
+        Returns the ENS of a subtree and the saving of adding a switch on each of
+        its arcs, the coefficients of the Benders cut of the subtree.\\
+        A switch on arc (i, j) removes F[i, j] from every arc between j and the
+        top of the subtree, so its saving is F[i, j] times the weight of that path.\\
+        arcs : indexes into G.edges of the arcs of a subtree, see Graph.get_subtrees\\
+        F : interruption flow of every arc in the current placement
+        """
+        arcs = np.asarray(arcs, dtype=np.int64)
+        G = self.G
+        top = G.tail[arcs[np.argmin(self.depth[arcs])]]
+        flow = F[arcs]
+        ENS = float(np.dot(self.weight[arcs], flow))
+        savings = flow * (self.prefix_weight[G.head[arcs]] - self.prefix_weight[top])
+        return ENS, savings
+
+    def sector_keys(self, sectors : Sectors, X : np.ndarray) -> list[tuple[int, frozenset[int]]]:
+        """
+        Returns a canonical key of every sector of a placement, its root arc and
+        the set of switched arcs directly below it. A sector is every arc below
+        its root arc up to these switches, so equal sectors have equal keys
+        whatever the rest of the placement. Keys are found in one pass over the
+        switched arcs, without gathering the arcs of each sector.\\
+        sectors : G.get_sectors(X)
+        """
+        G = self.G
+        switched = np.flatnonzero(np.asarray(X) == 1)
+        parent_arc = G.arc_id[G.tail[switched]]
+        switched, parent_arc = switched[parent_arc >= 0], parent_arc[parent_arc >= 0]
+        # a switched arc bounds the sector of its parent arc, if that arc is open
+        owner = sectors.sector[parent_arc]
+        switched, owner = switched[owner >= 0], owner[owner >= 0]
+
+        by_owner = np.argsort(owner, kind='stable')
+        offsets = np.searchsorted(owner[by_owner], np.arange(len(sectors) + 1)).tolist()
+        boundary = switched[by_owner].tolist()
+        return [(root, frozenset(boundary[offsets[s]:offsets[s + 1]]))
+            for s, root in enumerate(sectors.roots.tolist())]
+
+class IncrementalENS:
+    """
+    Stateful ENS evaluation of one placement that is changed one switch at a time.\\
+    Toggling the switch on arc (i, j) only changes F on the path from j up to the
+    nearest switch above it, so deltas and toggles cost O(depth of the sector)
+    instead of O(|A|). Arcs are indexes into G.edges.
+    """
+    def __init__(self, evaluator : ENSEvaluator, X : np.ndarray, result : ENSResult = None) -> None:
+        """
+        evaluator : ENSEvaluator of the graph\\
+        X : initial placement vector\\
+        result : evaluator.evaluate(X), if already computed
+        """
+        G = evaluator.G
+        self.evaluator = evaluator
+        self.parent = G.parent.tolist()
+        self.head = G.head.tolist()
+        self.arc_id = G.arc_id.tolist()
+        self.prefix_weight = evaluator.prefix_weight.tolist()
+        self.reset(X, result)
+
+    def reset(self, X : np.ndarray, result : ENSResult = None) -> None:
+        """
+        Sets the current placement, recomputing the state from scratch.
+        """
+        if result is None:
+            result = self.evaluator.evaluate(X)
+        head = self.evaluator.G.head
+        size = len(self.parent)
+
+        self.X = np.asarray(X).astype(np.int64).tolist()
+        # switch on the arc into each node, nodes without a parent act as switched
+        switched = np.ones(size, dtype=np.int64)
+        switched[head] = self.X
+        self.switched = switched.tolist()
+        # downstream theta and interruption flow of the arc into each node
+        R = np.zeros(size)
+        R[head] = result.R
+        self.R = R.tolist()
+        F = np.zeros(size)
+        F[head] = result.F
+        self.F = F.tolist()
+        self.ens = float(result.ens)
+
+    def _path_weight(self, j : int) -> float:
+        """
+        Returns the sum of weights from the arc into j up to the nearest switch above j.
+        """
+        u = self.parent[j]
+        while not self.switched[u]:
+            u = self.parent[u]
+        return self.prefix_weight[j] - self.prefix_weight[u]
+
+    def delta(self, a : int) -> float:
+        """
+        Returns the change in ENS if the switch on arc a is toggled.
+        """
+        j = self.head[a]
+        change = self.R[j] * self._path_weight(j)
+        return change if self.X[a] else -change
+
+    def toggle(self, a : int) -> float:
+        """
+        Toggles the switch on arc a and returns the change in ENS.
+        """
+        change = self.delta(a)
+        j = self.head[a]
+        dF = self.R[j] if self.X[a] else -self.R[j]
+        self.X[a] = 1 - self.X[a]
+        self.switched[j] = self.X[a]
+        self.F[j] += dF
+
+        u = self.parent[j]
+        while True:
+            self.R[u] += dF
+            if self.switched[u]:
+                break
+            self.F[u] += dF
+            u = self.parent[u]
+
+        self.ens += change
+        return change
+
+    def swap_delta(self, remove : int, add : int) -> float:
+        """
+        Returns the change in ENS if the switch on arc remove is moved to arc add.
+        """
+        change = self.toggle(remove)
+        change += self.delta(add)
+        self.toggle(remove)
+        return change
+
+    def swap(self, remove : int, add : int) -> float:
+        """
+        Moves the switch on arc remove to arc add and returns the change in ENS.
+        """
+        return self.toggle(remove) + self.toggle(add)
+
+    def placement(self) -> np.ndarray:
+        """
+        Returns the current placement vector.
+        """
+        return np.array(self.X, dtype=np.float64)
+
+class SwapBatch:
+    """
+    Scores batches of switch moves on the placement of an IncrementalENS with
+    vectorized array operations, and applies moves through it.\\
+    A move takes the switch off arc r and puts it on open arc a. Its change in
+    ENS follows from R and the nearest switched node above each node: the
+    removal adds R[j_r] to the arcs up to the switch above r, the addition
+    removes R[j_a] from the arcs up to the switch above a, where R[j_a] grows by
+    R[j_r] when a lies between r and that switch and the switch above a is the
+    one above r when a lies in the sector below r.
+    """
+    def __init__(self, ens : IncrementalENS) -> None:
+        G = ens.evaluator.G
+        self.ens = ens
+        self.head = G.head
+        self.parent = G.parent
+        self.tin = G.tin
+        self.tout = G.tout
+        self.prefix_weight = ens.evaluator.prefix_weight
+        self.reset()
+
+    def reset(self) -> None:
+        """
+        Copies the state of the IncrementalENS, after it was changed directly.
+        """
+        ens = self.ens
+        G = ens.evaluator.G
+        self.R = np.array(ens.R)
+        # nearest switched node at or above each node, by pre-order position
+        parent, switched, tin = ens.parent, ens.switched, G.tin.tolist()
+        top = [0] * len(G.order)
+        for v in G.order.tolist():
+            top[tin[v]] = v if switched[v] else top[tin[parent[v]]]
+        self.top = np.array(top, dtype=np.int64)
+
+    def deltas(self, removes : np.ndarray, adds : np.ndarray) -> np.ndarray:
+        """
+        Returns the change in ENS of moving the switch on arc removes[k] to arc
+        adds[k], for each k.
+        """
+        head, tin, top, R, prefix_weight = self.head, self.tin, self.top, self.R, self.prefix_weight
+        j_r = head[removes]
+        j_a = head[adds]
+        above_r = top[tin[self.parent[j_r]]]
+        R_r = R[j_r]
+        change = R_r * (prefix_weight[j_r] - prefix_weight[above_r])
+
+        above_a = top[tin[j_a]]
+        between = (above_a == above_r) & (tin[j_a] <= tin[j_r]) & (tin[j_r] < self.tout[j_a])
+        above_a = np.where(above_a == j_r, above_r, above_a)
+        return change - (R[j_a] + between * R_r) * (prefix_weight[j_a] - prefix_weight[above_a])
+
+    def swap(self, remove : int, add : int) -> float:
+        """
+        Moves the switch on arc remove to arc add and returns the change in ENS.
+        """
+        ens = self.ens
+        parent, switched = ens.parent, ens.switched
+        j_r = ens.head[remove]
+        j_a = ens.head[add]
+        tin, tout, top = self.tin, self.tout, self.top
+        above_r = top[tin[parent[j_r]]]
+        change = ens.swap(remove, add)
+
+        # R changed on the paths from both arcs up to the next switch
+        R, R_list = self.R, ens.R
+        for j in (j_r, j_a):
+            u = parent[j]
+            while True:
+                R[u] = R_list[u]
+                if switched[u]:
+                    break
+                u = parent[u]
+
+        below = top[tin[j_r]:tout[j_r]]
+        below[below == j_r] = above_r
+        below = top[tin[j_a]:tout[j_a]]
+        below[below == below[0]] = j_a
+        return change
+
+def get_evaluator(G : Graph) -> ENSEvaluator:
+    """
+    Returns the ENSEvaluator of a graph, created on first use.
+    """
+    if getattr(G, '_evaluator', None) is None:
+        G._evaluator = ENSEvaluator(G)
+    return G._evaluator
@@ -0,0 +1,126 @@
+"""
+This module contains build_switch_model, which builds the switch placement
+model shared by run_mip and the Benders master with the Gurobi matrix API.
+Constraints are built from scipy sparse incidence matrices over the graph
+arrays, so building takes time linear in the amount of arcs. The model is
+stored in a BuiltModel, and set_mip_start gives it a placement as MIP start.
+"""
+
+import gurobipy as gp
+import numpy as np
+import scipy.sparse as sp
+from dataclasses import dataclass, field
+from time import perf_counter
+from util import Graph
+from ens import get_evaluator
+
+@dataclass
+class BuiltModel:
+    """
+    Stores a Gurobi model built once and solved for several P, see SolverSession\\
+    m : the model\\
+    X, F, FSlack : its switch, interruption flow and slack variables\\
+    max_switches : constraint on the amount of switches, only its right-hand side depends on P\\
+    cuts : keys of the Benders pool cuts already added to the model\\
+    build_time : time taken to build the model\\
+    solves : amount of solves of the model, only the first one reports build_time
+    """
+    m : gp.Model
+    X : dict[tuple[int, int], gp.Var]
+    F : dict[tuple[int, int], gp.Var]
+    FSlack : dict[int, gp.Var]
+    max_switches : gp.Constr
+    cuts : set[tuple[int, frozenset[int]]] = field(default_factory=set)
+    build_time : float = None
+    solves : int = 0
+
+def build_switch_model(G : Graph, N : int, M : float) -> BuiltModel:
+    """
+    Builds the model minimising ENS with at most N switches.\\
+    For arc (i, j): F[i, j] + FSlack[j] == theta[j] + sum of F[j, k], and FSlack[j] <= M * X[i, j].\\
+    G : graph of the model\\
+    N : maximum number of switches, including the switches between the root and the substations\\
+    M : big M of the slack coupling constraints
+    """
+    start = perf_counter()
+    m = gp.Model()
+
+    """
+    Sets
+    """
+
+    A = G.edges
+    vertices = G.vertices
+    n = len(A)
+
+    """
+    Data
+    """
+
+    weight = G.load_array[G.tail] - G.load_array[G.head]
+    theta = G.theta_array[G.head]
+    # position of the head of each arc among the slack variables
+    position = np.zeros(vertices.max() + 1, dtype=np.int64)
+    position[vertices] = np.arange(len(vertices))
+    head_position = position[G.head]
+
+    # Outgoing[i, k] = 1 if arc k leaves the head of arc i
+    child_arcs = np.flatnonzero(G.tail != 0)
+    Outgoing = sp.csr_matrix(
+        (np.ones(len(child_arcs)), (G.arc_id[G.tail[child_arcs]], child_arcs)), shape=(n, n))
+    Elb = G.get_ens_lower_bound()
+
+    """
+    Variables
+    """
+
+    X_vars = m.addMVar(n, vtype=gp.GRB.BINARY) # Assignment of switch on arc (i, j)
+    F_vars = m.addMVar(n, lb=0) # Interruption flow on arc (i, j)
+    FSlack_vars = m.addMVar(len(vertices), lb=0) # Interruption slack on node j
+
+    """
+    Objective
+    """
+
+    m.setObjective(weight @ F_vars + Elb, gp.GRB.MINIMIZE)
+
+    """
+    Constraints
+    """
+
+    # We must place switch between root and substation for all substations
+    m.addConstr(X_vars[np.flatnonzero(G.tail == 0)] == 1)
+
+    # Number of switches <= Max switches
+    X_list = X_vars.tolist()
+    MaxSwitches = m.addLConstr(gp.LinExpr([1.0] * n, X_list), gp.GRB.LESS_EQUAL, N)
+
+    # Node balance constraint
+    m.addConstr(F_vars + FSlack_vars[head_position] - Outgoing @ F_vars == theta)
+
+    # Slack only non-zero if switch present on arc
+    m.addConstr(FSlack_vars[head_position] - M * X_vars <= 0)
+
+    X = dict(zip(A, X_list))
+    F = dict(zip(A, F_vars.tolist()))
+    FSlack = dict(zip(vertices.tolist(), FSlack_vars.tolist()))
+    m.update()
+    return BuiltModel(m, X, F, FSlack, MaxSwitches, build_time = perf_counter() - start)
+
+def set_mip_start(G : Graph, placement : np.ndarray, X : dict[tuple[int, int], gp.Var],
+        F : dict[tuple[int, int], gp.Var], FSlack : dict[int, gp.Var]) -> float:
+    """
+    Sets the Start attribute of the variables of a model to a placement and its
+    interruption flows. The slack of node j is the downstream theta of the arc
+    into j when that arc has a switch, and 0 otherwise.\\
+    Returns the objective value of the start.
+    """
+    evaluator = get_evaluator(G)
+    result = evaluator.evaluate(placement)
+    for a, x, f in zip(G.edges, placement.tolist(), result.F.tolist()):
+        X[a].Start = x
+        F[a].Start = f
+    slack = evaluator.slack(result)
+    for j, var in FSlack.items():
+        var.Start = slack[j]
+    return float(result.ens) + G.get_ens_lower_bound()
@@ -3,8 +3,8 @@ import numpy as np
 from reader import Node, Edge, Info
 from tqdm import tqdm
 
-def generate_similar_graph(G : Graph, nodes_factor : int = 1) -> Graph:
-    np.random.seed(0)
+def generate_similar_graph(G : Graph, nodes_factor : int = 1, seed : int = 0) -> Graph:
+    np.random.seed(seed)
 
     n_substations = len(G.substations)
     n_nodes = nodes_factor * len(G.index_node) - 1
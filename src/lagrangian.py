@@ -0,0 +1,219 @@
+"""
+This module contains the Lagrangian relaxation of the max switches constraint.
+
+Moving sum X <= N into the objective with a multiplier lam gives
+min ENS(X) + lam * (sum X - N), a lower bound of the optimum for every lam >= 0.
+Without the budget every switch is decided independently given the nearest
+switch above it, so the relaxation is solved by one pass over the tree, level
+by level from the deepest, see run_dp for the budgeted tables. The multiplier
+is found by bisection on the number of switches of the relaxed placement, and
+the last relaxed placements on both sides of the budget are repaired to N
+switches for an upper bound.
+"""
+
+import numpy as np
+from dataclasses import dataclass
+from time import perf_counter
+from util import Graph
+from ens import get_evaluator
+from params import ModelOutput, ModelParams
+from timing import PhaseTimer
+from warmstart import switch_budget, complete_placement
+from sa import run_optimisation_fixed
+
+@dataclass
+class LagrangianResult:
+    """
+    Stores the output of lagrangian_bound\\
+    lower_bound : best Lagrangian bound on the optimal ENS, including the ENS lower bound\\
+    upper_bound : ENS of placement\\
+    placement : best repaired placement vector with at most N switches\\
+    gap : (upper_bound - lower_bound) / upper_bound\\
+    multiplier : multiplier of the best lower bound\\
+    iterations : number of relaxations solved\\
+    time : wall time in seconds
+    """
+    lower_bound : float
+    upper_bound : float
+    placement : np.ndarray
+    gap : float
+    multiplier : float
+    iterations : int
+    time : float
+
+class _TreeLevels:
+    """
+    Arcs grouped by depth, each level sorted by parent arc, with the prefix
+    weights of the heads of the ancestors of each arc (one column per depth above it).
+    """
+    def __init__(self, G : Graph) -> None:
+        evaluator = get_evaluator(G)
+        depth = evaluator.depth
+        prefix_weight = evaluator.prefix_weight
+        parent_arc = G.arc_id[G.tail]
+        position = np.zeros(len(G.head), dtype=np.int64)
+
+        self.levels = []
+        for d in range(int(depth.max()) + 1 if len(depth) else 0):
+            arcs = np.flatnonzero(depth == d)
+            if d > 0:
+                arcs = arcs[np.argsort(position[parent_arc[arcs]], kind='stable')]
+            position[arcs] = np.arange(len(arcs))
+            heads = G.head[arcs]
+            level = {
+                'arcs' : arcs,
+                'theta' : G.theta_array[heads],
+                'prefix_weight' : prefix_weight[heads]
+            }
+            if d > 0:
+                parents = position[parent_arc[arcs]]
+                above = self.levels[-1]
+                level['parent'] = parents
+                level['starts'] = np.concatenate(([0], np.flatnonzero(np.diff(parents)) + 1))
+                level['ancestors'] = np.column_stack((above['ancestors'][parents], above['prefix_weight'][parents]))
+            else:
+                level['ancestors'] = np.zeros((len(arcs), 0))
+            self.levels.append(level)
+
+    def relax(self, lam : float) -> tuple[float, np.ndarray]:
+        """
+        Returns min ENS(X) + lam * sum X over all placements and a placement
+        reaching it, with the fewest switches among ties.
+        """
+        levels = self.levels
+        choices = [None] * len(levels)
+        f = None
+        for d in range(len(levels) - 1, -1, -1):
+            level = levels[d]
+            # sum of the tables of the children, column d is a switch on the arc itself
+            g = np.zeros((len(level['arcs']), d + 1))
+            if f is not None:
+                below = levels[d + 1]
+                g[below['parent'][below['starts']]] = np.add.reduceat(f, below['starts'], axis=0)
+            switched = lam + g[:, d]
+            if d == 0:
+                # switches between the root and the substations are always placed
+                total = float(switched.sum())
+                break
+            opened = level['theta'][:, None] * (level['prefix_weight'][:, None] - level['ancestors']) + g[:, :d]
+            choices[d] = switched[:, None] < opened
+            f = np.where(choices[d], switched[:, None], opened)
+        else:
+            total = 0.0
+
+        """
+        Placement, top-down
+        """
+
+        X = np.zeros(sum(len(level['arcs']) for level in levels))
+        if not levels:
+            return total, X
+        X[levels[0]['arcs']] = 1
+        # depth of the nearest switch above each arc of the current level
+        row = np.zeros(len(levels[0]['arcs']), dtype=np.int64)
+        is_switched = np.ones(len(levels[0]['arcs']), dtype=bool)
+        for d in range(1, len(levels)):
+            level = levels[d]
+            parents = level['parent']
+            row = np.where(is_switched[parents], d - 1, row[parents])
+            is_switched = choices[d][np.arange(len(row)), row]
+            X[level['arcs']] = is_switched
+        return total, X
+
+def lagrangian_bound(G : Graph, N : int, iterations : int = 60, tolerance : float = 1e-9) -> LagrangianResult:
+    """
+    Maximises the Lagrangian bound of the placement of at most N switches by
+    bisection on the multiplier, until the relaxed placement has exactly N
+    switches, the multiplier interval is below tolerance (relative) or after
+    iterations relaxations.\\
+    G : graph to place switches on\\
+    N : maximum number of switches, including the switches between the root and the substations
+    """
+    start = perf_counter()
+    evaluator = get_evaluator(G)
+    Elb = G.get_ens_lower_bound()
+    levels = _TreeLevels(G)
+
+    best_lower = -np.inf
+    multiplier = 0.0
+    # last relaxed placements above and within the budget
+    placements = {}
+
+    def solve(lam : float) -> int:
+        """
+        Solves the relaxation for lam, updates the lower bound and returns its number of switches.
+        """
+        nonlocal best_lower, multiplier
+        total, X = levels.relax(lam)
+        count = int(X.sum())
+        if total - lam * N + Elb > best_lower:
+            best_lower = total - lam * N + Elb
+            multiplier = lam
+        placements[count > N] = X
+        return count
+
+    # without a multiplier every switch that saves ENS is placed
+    low = 0.0
+    count = solve(low)
+    # no switch saves more than the ENS of the placement with only the mandatory switches
+    high = float(evaluator.evaluate((G.tail == 0).astype(np.float64)).ens) + 1.0
+    solved = 1
+    if count > N:
+        solve(high)
+        solved += 1
+        while solved < iterations and high - low > tolerance * high:
+            lam = (low + high) / 2
+            count = solve(lam)
+            solved += 1
+            if count == N:
+                break
+            if count > N:
+                low = lam
+            else:
+                high = lam
+
+    # the placements on both sides of the budget are repaired to N switches
+    best_upper = np.inf
+    best_X = None
+    for X in placements.values():
+        repaired = complete_placement(G, N, X)
+        upper = float(evaluator.evaluate(repaired).ens) + Elb
+        if upper < best_upper:
+            best_upper, best_X = upper, repaired
+
+    # the bound and the ENS of a placement differ by rounding over at most |A| terms,
+    # a larger crossing means the relaxation is wrong
+    rounding = len(G.head) * np.finfo(np.float64).eps * max(1.0, abs(best_upper))
+    assert best_lower <= best_upper + rounding, \
+        f'Lagrangian bound {best_lower} is above the ENS {best_upper} of a feasible placement'
+    return LagrangianResult(
+        lower_bound = best_lower,
+        upper_bound = best_upper,
+        placement = best_X,
+        gap = (best_upper - best_lower) / best_upper if best_upper else 0.0,
+        multiplier = multiplier,
+        iterations = solved,
+        time = perf_counter() - start
+    )
+
+def run_lagrangian(params : ModelParams) -> ModelOutput:
+    """
+    Runs the Lagrangian relaxation for given parameters, see lagrangian_bound.
+    Returns the repaired placement, with the gap to the Lagrangian bound in
+    ModelOutput.gap and the bound in ModelOutput.lower_bound.
+    """
+    G = params.G
+    P = params.P
+    timer = PhaseTimer(params.phases)
+    with timer.phase('solve'):
+        result = lagrangian_bound(G, switch_budget(G, P))
+    with timer.phase('extract'):
+        output = run_optimisation_fixed(G, P, dict(zip(G.edges, result.placement.astype(int).tolist())),
+            params.verbal)
+    if params.verbal:
+        print(f'Lagrangian bound: {result.lower_bound}, gap {result.gap:.3%} after {result.iterations} relaxations')
+    output.time = result.time + output.time
+    output.gap = result.gap
+    output.lower_bound = result.lower_bound
+    output.phases = timer.result()
+    return output
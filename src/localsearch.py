@@ -0,0 +1,211 @@
+"""
+This module contains the local search that polishes a placement, after
+simulated annealing or from any placement given by the caller.
+
+A 1-swap moves one switch to an open arc, a 2-swap moves two switches at
+once. Moves are only tried towards nearby arcs, the arcs whose head is at
+most radius edges away in the tree, and the best move of each switch is kept
+in a priority queue. After a move only the switches near it are evaluated
+again, and the search ends with a full pass that finds no improving move.
+"""
+
+import heapq
+import numpy as np
+from dataclasses import dataclass, field
+from time import perf_counter
+from util import Graph
+from ens import IncrementalENS, get_evaluator
+from warmstart import complete_placement
+
+@dataclass
+class LocalSearchResult:
+    """
+    Stores the output of local_search\\
+    placement : placement vector of the local optimum\\
+    obj : ENS of the placement, including the ENS lower bound\\
+    stats : initial ENS, amount of 1-swaps, 2-swaps and evaluated moves, time
+    """
+    placement : np.ndarray
+    obj : float
+    stats : dict[str, float] = field(default_factory=dict)
+
+class _Neighbourhoods:
+    """
+    Nearby arcs of each arc, computed on first use. The arcs near arc a are
+    the arcs into the nodes at most radius edges away from the head of a,
+    without a itself and the arcs out of the root.
+    """
+    def __init__(self, G : Graph) -> None:
+        self.parent = G.parent.tolist()
+        self.head = G.head.tolist()
+        self.arc_id = G.arc_id.tolist()
+        self.children = G.children.tolist()
+        self.child_offsets = G.child_offsets.tolist()
+        self.fixed = (G.tail == 0).tolist()
+        self._cache = {}
+
+    def __call__(self, a : int, radius : int) -> list[int]:
+        key = (a, radius)
+        arcs = self._cache.get(key)
+        if arcs is not None:
+            return arcs
+        parent, children, child_offsets = self.parent, self.children, self.child_offsets
+        start = self.head[a]
+        seen = {start}
+        frontier = [start]
+        for _ in range(radius):
+            reached = []
+            for u in frontier:
+                p = parent[u]
+                if p >= 0 and p not in seen:
+                    seen.add(p)
+                    reached.append(p)
+                for v in children[child_offsets[u]:child_offsets[u + 1]]:
+                    if v not in seen:
+                        seen.add(v)
+                        reached.append(v)
+            frontier = reached
+        arc_id, fixed = self.arc_id, self.fixed
+        arcs = [arc_id[v] for v in seen if arc_id[v] >= 0 and not fixed[arc_id[v]] and arc_id[v] != a]
+        self._cache[key] = arcs
+        return arcs
+
+def local_search(G : Graph, N : int, X : np.ndarray, radius : int = 3, two_swap : bool = True,
+        two_swap_width : int = 3, two_swap_radius : int = 2, tolerance : float = 1e-9) -> LocalSearchResult:
+    """
+    Runs best-improvement local search from a placement until no 1-swap or
+    2-swap towards nearby arcs lowers ENS.\\
+    G : graph to place switches on\\
+    N : number of switches, including the switches between the root and the substations\\
+    X : initial placement vector, fitted to N switches with complete_placement\\
+    radius : a switch is only moved to arcs at most radius edges away\\
+    two_swap : if true, 2-swaps are tried once no 1-swap improves, the best 2-swap
+    starting with each switch is applied if it lowers ENS\\
+    two_swap_width : the first switch of a 2-swap is only moved to its two_swap_width best nearby arcs\\
+    two_swap_radius : the second switch of a 2-swap is at most two_swap_radius edges away from the
+    first move, and is moved to an arc in that region\\
+    tolerance : smallest decrease of ENS that counts as an improvement
+    """
+    start = perf_counter()
+    evaluator = get_evaluator(G)
+    Elb = G.get_ens_lower_bound()
+    X = complete_placement(G, N, X)
+    ens = IncrementalENS(evaluator, X)
+    initial = ens.ens
+    nearby = _Neighbourhoods(G)
+    fixed = nearby.fixed
+
+    state = ens.X
+    toggle, delta, swap = ens.toggle, ens.delta, ens.swap
+    evaluations = 0
+
+    def moves(r : int, targets : list[int] = None) -> list[tuple[float, int]]:
+        """
+        Returns the change in ENS of moving the switch on arc r to each nearby open arc,
+        or to each open arc of targets.
+        """
+        nonlocal evaluations
+        change = toggle(r)
+        options = [(change + delta(a), a) for a in (targets or nearby(r, radius)) if not state[a]]
+        toggle(r)
+        evaluations += len(options)
+        return options
+
+    """
+    1-swaps
+    """
+
+    # best move of each switch with the version of the switch it was computed at
+    version = [0] * len(state)
+    heap = []
+
+    def push(r : int) -> None:
+        version[r] += 1
+        options = moves(r)
+        if options:
+            change, a = min(options)
+            if change < -tolerance:
+                heapq.heappush(heap, (change, version[r], r, a))
+
+    def switched() -> list[int]:
+        return [r for r, x in enumerate(state) if x and not fixed[r]]
+
+    one_swaps = two_swaps = 0
+    # arcs near the moves since the last 2-swap pass, None before the first pass
+    touched = None
+    for r in switched():
+        push(r)
+    while True:
+        while heap:
+            change, v, r, a = heapq.heappop(heap)
+            if v != version[r] or not state[r] or state[a]:
+                continue
+            # moves further away may have changed the saving since it was computed
+            if ens.swap_delta(r, a) > change + tolerance:
+                push(r)
+                continue
+            swap(r, a)
+            one_swaps += 1
+            version[r] += 1
+            around = {a, *nearby(r, 2 * radius), *nearby(a, 2 * radius)}
+            for s in around:
+                if state[s] and not fixed[s]:
+                    push(s)
+            if touched is not None:
+                touched |= around
+
+        # a move can change the savings of switches far below it, check every switch
+        for r in switched():
+            push(r)
+        if heap:
+            continue
+
+        """
+        2-swaps
+        """
+
+        if not two_swap:
+            break
+        applied = two_swaps
+        # only switches near earlier moves can have a new improving 2-swap
+        first = switched() if touched is None else [r for r in touched if state[r] and not fixed[r]]
+        touched = set()
+        for r in first:
+            if not state[r]:
+                continue
+            best, best_move = -tolerance, None
+            for change, a in sorted(moves(r))[:two_swap_width]:
+                swap(r, a)
+                # the second move only gains from the first one near it
+                region = list({r, *nearby(r, two_swap_radius), *nearby(a, two_swap_radius)})
+                for s in region:
+                    if state[s] and not fixed[s] and s != a:
+                        options = moves(s, region)
+                        if options:
+                            second, b = min(options)
+                            if change + second < best:
+                                best, best_move = change + second, (a, s, b)
+                swap(a, r)
+            if best_move is not None:
+                a, s, b = best_move
+                swap(r, a)
+                swap(s, b)
+                two_swaps += 1
+                version[r] += 1
+                version[s] += 1
+                around = {a, b, *nearby(r, 2 * radius), *nearby(s, 2 * radius)}
+                for t in around:
+                    if state[t] and not fixed[t]:
+                        push(t)
+                touched |= around
+        if two_swaps == applied:
+            break
+
+    stats = {
+        'initial_obj' : initial + Elb,
+        'one_swaps' : one_swaps,
+        'two_swaps' : two_swaps,
+        'evaluations' : evaluations,
+        'time' : perf_counter() - start
+    }
+    return LocalSearchResult(ens.placement(), ens.ens + Elb, stats)
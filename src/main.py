@@ -4,6 +4,7 @@ This file contains an example for how to run the different optimisation methods.
 from params import ModelParams, ModelOutput
 from benders import run_benders
 from mip import run_mip
+from dp import run_dp
 from check_validity import check_constraints
 
 """
@@ -24,8 +25,16 @@ less time for some select situations.
 benders_output = run_benders(params)
 mip_output = run_mip(params)
 
+"""
+On a radial network the problem can also be solved exactly without Gurobi by
+dynamic programming over the tree, which scales to generated networks that are
+too large for the MIP.
+"""
+dp_output = run_dp(params)
+
 print(f'Benders Objective: {round(benders_output.obj, ndigits=3)}, Benders Time to Optimality: {round(benders_output.time, ndigits=3)}')
 print(f'MIP Objective: {round(mip_output.obj, ndigits = 3)}, MIP Time to Optimality: {round(mip_output.time, ndigits=3)}')
+print(f'DP Objective: {round(dp_output.obj, ndigits = 3)}, DP Time to Optimality: {round(dp_output.time, ndigits=3)}')
 
 """
 The validity of a solution, i.e. it did not violate any constraints, can be checked as 
@@ -33,4 +42,5 @@ such. This is used to ensure that the optimization functions had constraint that
 correctly configured.
 """
 check_constraints(params, benders_output)
-check_constraints(params, mip_output)
\ No newline at end of file
+check_constraints(params, mip_output)
+check_constraints(params, dp_output)
\ No newline at end of file
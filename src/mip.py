@@ -2,113 +2,55 @@
 This module contains run_mip, the function used to run the mixed-integer model.
 """
 
-import gurobipy as gp
-from util import Graph
-from math import floor
+import numpy as np
 from params import ModelOutput, ModelParams
+from formulation import BuiltModel, build_switch_model, set_mip_start
+from timing import PhaseTimer
+from warmstart import switch_budget, warm_start_placement
 
-def run_mip(params : ModelParams) -> ModelOutput:
-    """
-    Runs basic MIP optimization for given parameters.\\
-    """
-
+def build_mip(params : ModelParams) -> BuiltModel:
     """
-    Loading in parameters
+    Builds the MIP of params.G. The model only depends on P through the
+    right-hand side of the max switches constraint, which solve_mip sets.
     """
     G = params.G
-    verbal = params.verbal
-    time_limit = params.time_limit
-    presolve = params.do_presolve
-    P = params.P
-    
-    """
-    Setup
-    """
-
-    m = gp.Model()
+    return build_switch_model(G, switch_budget(G, params.P), G.M)
 
+def solve_mip(built : BuiltModel, params : ModelParams, placement : np.ndarray = None) -> ModelOutput:
     """
-    Sets
+    Solves a model from build_mip for params.P.\\
+    placement : placement vector to warm start from, by default the warm start of params
     """
 
-    V = G.V
-    A = G.edges
-
     """
-    Data
+    Setup
     """
-
-    L_D = G.downstream_load
-    Theta = G.theta
-    # M = 2**32 # Very large value
-    M = G.M
-    P = P # Percentage of arcs that can be switches
-    # Maximum number of switches that can be placed, including mandatory between substations and root
-    N = floor(P * len(A)) + len(G.substations)
-    Outgoing = G.outgoing # stores nodes that go out of j for incoming (i, j)
-
+    G = params.G
+    verbal = params.verbal
+    time_limit = params.time_limit
+    presolve = params.do_presolve
+    m, X, F, BigF = built.m, built.X, built.F, built.FSlack
+    built.max_switches.RHS = switch_budget(G, params.P)
     Elb = G.get_ens_lower_bound()
     Eub = G.get_ens_upper_bound()
+    # a model solved for several P is built once, the build is reported by its first solve
+    build_time = None if built.solves else built.build_time
+    built.solves += 1
+    timer = PhaseTimer(params.phases)
+    if build_time is not None:
+        timer.add('build', build_time)
 
     """
-    Variables
-    """
-
-    X = { # Assignment of switch on arc (i, j)
-        (i, j) : m.addVar(vtype=gp.GRB.BINARY)
-        for i, j in A
-    }
-
-    F = { # Interruption flow on arc (i, j)
-        (i, j) : m.addVar(lb=0)
-        for i, j in A
-    }
-
-    BigF = { # Interruption slack on node j
-        j : m.addVar()
-        for j in V
-    }
-
-    """
-    Objective
+    Warm start
     """
 
-    m.setObjective(
-        gp.quicksum((L_D[i] - L_D[j]) * F[i, j] for (i, j) in A) + Elb,
-        gp.GRB.MINIMIZE
-    )
-
-    """
-    Constraints
-    """
-
-    # We must place switch between root and substation for all substations
-    SwitchesBetweenRootAndSubstation = {
-        (0, j) :
-        m.addConstr(X[0, j] == 1)
-        for j in V if (0, j) in A
-    }
-
-    # Number of switches <= Max switches
-    m.addConstr(gp.quicksum(X[i, j] for (i, j) in A) <= N)
-
-    # Node balance constraint
-    NodeBalance = {
-        (i, j) :
-        m.addConstr(
-            BigF[j] + F[i, j] == Theta[j] + gp.quicksum(F[j, k] for k in V if k in Outgoing[j])
-        )
-        for (i, j) in A
-    }
-
-    # Slack only non-zero if switch present on arc
-    SlackCoupling = {
-        (i, j) :
-        m.addConstr(
-            BigF[j] <= M * X[i, j] 
-        )
-        for (i, j) in A
-    }
+    with timer.phase('warm_start'):
+        if placement is None:
+            placement = warm_start_placement(params)
+        if placement is not None:
+            start_obj = set_mip_start(G, placement, X, F, BigF)
+            if verbal:
+                print('Warm start ENS:', start_obj)
 
     """
     Optimize + Output
@@ -127,7 +69,8 @@ def run_mip(params : ModelParams) -> ModelOutput:
     if not presolve:
         m.setParam('Presolve', 0)
 
-    m.optimize()
+    with timer.phase('solve'):
+        m.optimize()
 
     if verbal:
         model_output = [x for x in X if round(X[x].x) == 1]
@@ -136,9 +79,19 @@ def run_mip(params : ModelParams) -> ModelOutput:
         print('LB:', Elb)
         print('UB', Eub)
     
-    return ModelOutput(m.ObjVal, 
-        {x : round(X[x].X) for x in X}, 
-        {x : F[x].X for x in F}, 
-        {x : BigF[x].X for x in BigF}, 
-        m.Runtime,
-        m.MIPGap) 
\ No newline at end of file
+    with timer.phase('extract'):
+        output = ModelOutput(m.ObjVal, 
+            {x : round(X[x].X) for x in X}, 
+            {x : F[x].X for x in F}, 
+            {x : BigF[x].X for x in BigF}, 
+            m.Runtime,
+            m.MIPGap,
+            build_time = build_time)
+    output.phases = timer.result()
+    return output
+
+def run_mip(params : ModelParams) -> ModelOutput:
+    """
+    Runs basic MIP optimization for given parameters.\\
+    """
+    return solve_mip(build_mip(params), params)
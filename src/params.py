@@ -1,6 +1,10 @@
-from util import Graph, load_graph_object
+import json
+from util import Graph
+from cache import GraphCache, default_cache, load_graph_object
+from cutpool import CutPool
+from ens import get_evaluator
+from timing import PhaseTimer
 from random import randint
-from generate import generate_similar_graph
 from dataclasses import dataclass
 
 @dataclass
@@ -12,7 +16,16 @@ class ModelOutput:
     X : value of X variable - binary placement of switches\\
     F : value of F variabkles - Interruption time on arc\\
     FSlack : value of FSlack variables - Slack of interruption time on arc\\
-    time : gurobi run time
+    time : gurobi run time\\
+    gap : MIP gap at the end of optimisation\\
+    trace : if ModelParams.trace, one record per Benders callback, see write_trace\\
+    root_time : time of the Benders root cut loop, if it was run\\
+    root_bound : bound of the LP relaxation after the Benders root cut loop\\
+    build_time : time taken to build the Gurobi model, not included in time, None after the first solve of a model\\
+    phases : wall time in seconds of each phase of the run, e.g. load, preprocess, build, solve
+    and extract, and the peak memory of the process in bytes under peak_memory. Load and
+    preprocess are the loading of ModelParams, shared by every run on the same parameters\\
+    lower_bound : Lagrangian bound on the optimal ENS, see run_lagrangian and ModelParams.lagrangian
     """
     obj : float
     X : dict[tuple[int, int], float]
@@ -20,6 +33,20 @@ class ModelOutput:
     FSlack : dict[tuple[int, int], float]
     time : float
     gap : float = None
+    trace : list[dict[str, float]] = None
+    root_time : float = None
+    root_bound : float = None
+    build_time : float = None
+    phases : dict[str, float] = None
+    lower_bound : float = None
+
+    def write_trace(self, filename : str) -> None:
+        """
+        Writes the callback trace to filename as JSON lines, one record per callback.
+        """
+        with open(filename, 'w') as file:
+            for record in self.trace or []:
+                file.write(json.dumps(record) + '\n')
 
 class ModelParams:
     """
@@ -36,7 +63,23 @@ class ModelParams:
                 OptimalityTol : float = 1e-9,
                 make_similar_graph : bool = False,
                 gurobi_seed : int = None,
-                nodes_factor : int = 1
+                nodes_factor : int = 1,
+                graph_seed : int = 0,
+                cache : GraphCache = None,
+                persist_cuts : bool = False,
+                max_cut_bytes : int = 64 * 2**20,
+                trace : bool = False,
+                max_cut_rounds : int = 10,
+                max_node_cuts : int = 20,
+                cut_threshold : float = 0.5,
+                max_cut_nodes : int = 1,
+                warm_start : str | dict[tuple[int, int], int] = None,
+                warm_start_cuts : bool = True,
+                root_cut_rounds : int = 0,
+                root_stall_tolerance : float = 1e-4,
+                root_stall_rounds : int = 5,
+                stabilization : float = 0.5,
+                lagrangian : bool = False
                 ) -> None:
         """
         file_number : 3-7, number of dataset in networks to use
@@ -50,6 +93,23 @@ class ModelParams:
         make_similar_graph : if true, create graph with similar values as graph in file_number
         gurobi_seed : what value to seed gurobi randomizer with
         nodes_factor : if make_similar_graph, how many more nodes to multiply current amount by
+        graph_seed : if make_similar_graph, what value to seed the graph generator with
+        cache : GraphCache to load the graph through, None uses the default cache in graphs/
+        persist_cuts : if true, the Benders cut pool is loaded from and saved next to the cached graph
+        max_cut_bytes : approximate memory limit of the Benders cut pool, least recently used cuts are evicted
+        trace : if true, run_benders records the timing and progress of each callback in ModelOutput.trace
+        max_cut_rounds : rounds of Benders user cuts separated at each branch and bound node, 0 disables them
+        max_node_cuts : maximum amount of user cuts added in a round, most violated first
+        cut_threshold : smallest relaxed X rounded up to a switch when separating user cuts
+        max_cut_nodes : user cuts are separated at the first max_cut_nodes nodes, 1 separates them at the root only
+        warm_start : MIP start of run_benders and run_mip, 'greedy', 'sa' or a placement (e.g. ModelOutput.X), None for no start
+        warm_start_cuts : if true, run_benders adds the subtree cuts of the warm start to the cut pool
+        root_cut_rounds : maximum rounds of the Benders root cut loop on the LP relaxation, 0 skips it
+        root_stall_tolerance, root_stall_rounds : the root cut loop stops after root_stall_rounds rounds in a row
+        that improve the bound by less than root_stall_tolerance, relative to the bound
+        stabilization : weight of the LP solution in the separation point of the root cut loop, 1 disables stabilization
+        lagrangian : if true, run_benders computes the Lagrangian bound, sets the objective cutoff to the ENS
+        of its repaired placement and warm starts from that placement when warm_start is None
         """
         self.file_number  = file_number
         self.P = P
@@ -60,14 +120,37 @@ class ModelParams:
         self.FeasibilityTol = FeasibilityTol
         self.OptimalityTol = OptimalityTol
         self.gurobi_seed = gurobi_seed
+        self.trace = trace
+        self.max_cut_rounds = max_cut_rounds
+        self.max_node_cuts = max_node_cuts
+        self.cut_threshold = cut_threshold
+        self.max_cut_nodes = max_cut_nodes
+        self.warm_start = warm_start
+        self.warm_start_cuts = warm_start_cuts
+        self.root_cut_rounds = root_cut_rounds
+        self.root_stall_tolerance = root_stall_tolerance
+        self.root_stall_rounds = root_stall_rounds
+        self.stabilization = stabilization
+        self.lagrangian = lagrangian
 
         if self.gurobi_seed is None:
             self.gurobi_seed = randint(0, 2000000000 - 1)
         
-        self.G = load_graph_object(file_number)
+        if cache is None:
+            cache = default_cache
+        # time of loading the graph, shared by every output of these parameters
+        timer = PhaseTimer()
+        self.G = load_graph_object(file_number, make_similar_graph, nodes_factor, graph_seed, cache, timer)
+        with timer.phase('preprocess'):
+            get_evaluator(self.G)
+        self.phases = timer.phases
 
-        if make_similar_graph:
-            self.G = generate_similar_graph(self.G, nodes_factor)
+        # Benders cuts do not depend on P, so one pool is shared by every run on this graph
+        self.cut_pool_path = cache.cut_pool_path(self.G.cache_key) if persist_cuts else None
+        if persist_cuts:
+            self.cut_pool = CutPool.load(self.cut_pool_path, max_cut_bytes)
+        else:
+            self.cut_pool = CutPool(max_cut_bytes)
 
 if __name__ == "__main__":
     # G1 = ModelParams(6, 0.6).G
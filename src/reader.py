@@ -1,4 +1,7 @@
 from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
 
 @dataclass(frozen=True)
 class Node:
@@ -44,61 +47,143 @@ class Info:
     ties : list[Edge]
     all_edges : list[Edge]
     
-def read_pos_file(filename:str) -> Info:
+@dataclass
+class SwitchArrays:
     """
-    Reads from .switch file into Info object.
+    Stores the records of a dataset file as typed columns.\\
+    node_num, edge_num, ties_num : counts from the p header\\
+    index, theta, power, clients : columns of the v records\\
+    node1, node2 : sending and receiving nodes of the e records\\
+    tie1, tie2 : sending and receiving nodes of the t records, can be ignored
     """
-    with open(filename, 'r') as file:
-        lines = file.readlines()
-    
-    nodes:list[Node] = []
-    edges:list[Edge] = []
-    ties:list[Edge] = []
-    for line in lines:
-        # line is first line
-        if line.startswith('p'):
-            _, _, node_num, edge_num, ties_num = line.split()
-            node_num, edge_num, ties_num =\
-                (int(x) for x in [node_num, edge_num, ties_num])
-        # line is vertice line
-        elif line.startswith('v'):
-            _, index, _, theta, power, clients = line.split()
-            
-            nodes.append(
-                Node(
-                    index = int(index),
-                    theta = float(theta),
-                    power = float(power),
-                    clients = int(clients)
-                )
-            )
-        # line is edge line
-        elif line.startswith('e'):
-            _, node1, node2, _ = line.split()
-            edges.append(
-                Edge(
-                    node1 = int(node1),
-                    node2 = int(node2)
-                )
-            )
-        # line is tie line
-        elif line.startswith('t'):
-            _, node1, node2, _ = line.split()
-            ties.append(
-                Edge(
-                    node1 = int(node1),
-                    node2 = int(node2)
-                )
-            )
-    assert len(edges) == edge_num
-    assert len(nodes) == node_num
-    assert len(ties) == ties_num
-    return Info(
+    node_num : int
+    edge_num : int
+    ties_num : int
+    index : np.ndarray
+    theta : np.ndarray
+    power : np.ndarray
+    clients : np.ndarray
+    node1 : np.ndarray
+    node2 : np.ndarray
+    tie1 : np.ndarray
+    tie2 : np.ndarray
+
+# numeric fields after the record letter
+_RECORD_FIELDS = {'v' : 5, 'e' : 3, 't' : 3}
+
+def read_switch_arrays(filename : str, chunk_bytes : int = 1 << 23) -> SwitchArrays:
+    """
+    Reads a .switch file into typed columns, streaming the file in chunks
+    without creating an object per record. Consecutive records of the same
+    kind are parsed together by NumPy.\\
+    filename : path of the dataset file\\
+    chunk_bytes : size of the chunks read at a time
+    """
+    header = None
+    records = {kind : [] for kind in _RECORD_FIELDS}
+    kinds = {ord(kind) : kind for kind in _RECORD_FIELDS}
+
+    with open(filename, 'rb') as file:
+        remainder = b''
+        while True:
+            data = file.read(chunk_bytes)
+            chunk = remainder + data
+            if not data:
+                # last line may not end with a newline
+                remainder = b''
+            else:
+                end = chunk.rfind(b'\n') + 1
+                chunk, remainder = chunk[:end], chunk[end:]
+            if not chunk:
+                if not data:
+                    break
+                continue
+
+            buffer = np.frombuffer(chunk, dtype=np.uint8)
+            starts = np.concatenate(([0], np.flatnonzero(buffer[:-1] == ord('\n')) + 1))
+            line_kinds = buffer[starts]
+            # runs of consecutive lines with the same record letter
+            runs = np.concatenate(([0], np.flatnonzero(np.diff(line_kinds)) + 1, [len(starts)]))
+            for first, last in zip(runs[:-1].tolist(), runs[1:].tolist()):
+                begin = starts[first]
+                stop = starts[last] if last < len(starts) else len(chunk)
+                letter = line_kinds[first]
+                if letter == ord('p') and header is None:
+                    header = chunk[begin:stop].split(b'\n', 1)[0].split()
+                    continue
+                if letter not in kinds:
+                    continue
+                # blank the record letters so the run parses as numbers
+                run = buffer[begin:stop].copy()
+                run[starts[first:last] - begin] = ord(' ')
+                kind = kinds[letter]
+                values = np.fromstring(run.tobytes(), sep=' ')
+                if values.size % _RECORD_FIELDS[kind] != 0 or values.size // _RECORD_FIELDS[kind] != last - first:
+                    raise ValueError(f'{filename}: malformed {kind} records')
+                records[kind].append(values.reshape(-1, _RECORD_FIELDS[kind]))
+            if not data:
+                break
+
+    if header is None or len(header) != 5:
+        raise ValueError(f'{filename}: missing p header line')
+    node_num, edge_num, ties_num = (int(x) for x in header[2:])
+
+    v, e, t = (
+        np.concatenate(records[kind]) if records[kind] else np.empty((0, fields))
+        for kind, fields in _RECORD_FIELDS.items()
+    )
+    for kind, found, expected in (('v', len(v), node_num), ('e', len(e), edge_num), ('t', len(t), ties_num)):
+        if found != expected:
+            raise ValueError(f'{filename}: header gives {expected} {kind} records, found {found}')
+
+    return SwitchArrays(
         node_num = node_num,
         edge_num = edge_num,
         ties_num = ties_num,
+        index = v[:, 0].astype(np.int64),
+        theta = v[:, 2].copy(),
+        power = v[:, 3].copy(),
+        clients = v[:, 4].astype(np.int64),
+        node1 = e[:, 0].astype(np.int64),
+        node2 = e[:, 1].astype(np.int64),
+        tie1 = t[:, 0].astype(np.int64),
+        tie2 = t[:, 1].astype(np.int64)
+    )
+
+def read_switch_directory(directory : str = 'networks', max_workers : int = None) -> dict[str, SwitchArrays]:
+    """
+    Reads every .switch file in directory concurrently.\\
+    Returns a dictionary mapping file name -> SwitchArrays.\\
+    max_workers : number of worker processes, 1 reads in this process
+    """
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.endswith('.switch') and not name.startswith('.')
+    )
+    filenames = [os.path.join(directory, name) for name in names]
+    if max_workers == 1:
+        return {name : read_switch_arrays(f) for name, f in zip(names, filenames)}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(names, executor.map(read_switch_arrays, filenames)))
+
+def read_pos_file(filename:str) -> Info:
+    """
+    Reads from .switch file into Info object.
+    """
+    arrays = read_switch_arrays(filename)
+    nodes = [
+        Node(index = index, theta = theta, power = power, clients = clients)
+        for index, theta, power, clients in zip(arrays.index.tolist(), arrays.theta.tolist(),
+            arrays.power.tolist(), arrays.clients.tolist())
+    ]
+    edges = [Edge(node1 = i, node2 = j) for i, j in zip(arrays.node1.tolist(), arrays.node2.tolist())]
+    ties = [Edge(node1 = i, node2 = j) for i, j in zip(arrays.tie1.tolist(), arrays.tie2.tolist())]
+    return Info(
+        node_num = arrays.node_num,
+        edge_num = arrays.edge_num,
+        ties_num = arrays.ties_num,
         nodes = nodes,
         edges = edges,
         ties = ties,
         all_edges = ties + edges
-    )
\ No newline at end of file
+    )
@@ -1,12 +1,30 @@
 from benders import run_benders
 from mip import run_mip
 from tqdm import tqdm
-from util import Graph, load_graph_object
+from util import Graph
 import numpy as np
 import pandas
 from params import ModelParams, ModelOutput
+from session import SolverSession
 
-def output_runtimes(file_number, presolve:bool=True) -> None:
+def add_phases(dict_df : dict[str, list], prefix : str, output : ModelOutput) -> None:
+    """
+    Appends the phase breakdown of an output to columns {prefix}_{phase} of dict_df.
+    Phases missing from an output, e.g. the build after the first solve of a session, are 0.
+    """
+    rows = len(dict_df['P'])
+    for phase, value in output.phases.items():
+        dict_df.setdefault(f'{prefix}_{phase}', [0.0] * (rows - 1)).append(value)
+    for name, column in dict_df.items():
+        if name.startswith(f'{prefix}_') and len(column) < rows:
+            column.append(0.0)
+
+def output_runtimes(file_number, presolve:bool=True, persist_cuts:bool=False) -> None:
+    """
+    Writes the Benders and MIP runtimes of a P sweep to outputs/{file_number}.csv.
+    The Benders cut pool is shared by the sweep in memory, with persist_cuts it is
+    also loaded from and saved to the graph cache, so runtimes depend on earlier runs.
+    """
     dict_df = {
         'P' : [],
         'benders' : [],
@@ -14,18 +32,22 @@ def output_runtimes(file_number, presolve:bool=True) -> None:
         'benders_obj' : [],
         'mip_obj' : []
     }
-    params = ModelParams(file_number, 0, do_presolve=presolve)
+    params = ModelParams(file_number, 0.2, do_presolve=presolve, persist_cuts=persist_cuts)
+    # one model per method, re-solved for increasing P
+    benders_session = SolverSession(params, 'benders')
+    mip_session = SolverSession(params, 'mip')
 
     for p in tqdm(np.arange(0.2, 1.0, 0.2)):
-        params.P = p
-        benders_output = run_benders(params)
-        mip_output = run_mip(params)
+        benders_output = benders_session.solve(p)
+        mip_output = mip_session.solve(p)
 
         dict_df['benders'].append(benders_output.time)
         dict_df['mip'].append(mip_output.time)
         dict_df['P'].append(round(p, 1))
         dict_df['benders_obj'].append(benders_output.obj)
         dict_df['mip_obj'].append(mip_output.obj)
+        add_phases(dict_df, 'benders', benders_output)
+        add_phases(dict_df, 'mip', mip_output)
     
     print(dict_df)
     df = pandas.DataFrame(dict_df)
@@ -57,6 +79,8 @@ def output_runtimes2(params:ModelParams) -> None:
         dict_df['mip_obj'].append(mip_output.obj)
         dict_df['benders_gap'].append(benders_output.gap)
         dict_df['mip_gap'].append(mip_output.gap)
+        add_phases(dict_df, 'benders', benders_output)
+        add_phases(dict_df, 'mip', mip_output)
     
     print(dict_df)
     df = pandas.DataFrame(dict_df)
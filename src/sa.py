@@ -1,251 +1,110 @@
-import gurobipy as gp
 from util import Graph
 from math import floor
 import numpy as np
+from ens import get_evaluator
+from anneal import SAConfig, anneal, parallel_anneal
+from localsearch import local_search
 from params import ModelOutput, ModelParams
+from timing import PhaseTimer
+from time import perf_counter
 
 def run_optimisation_fixed(G:Graph, P : float, solution : dict[tuple[int, int], int],
                     verbal : bool = False) -> ModelOutput:
     """
-    Runs basic MIP optimization for given parameters.\\
-    file_number : which dataset to use, between 3 and 7\\
+    Evaluates a fixed switch placement without Gurobi. On a radial network the
+    interruption flows and slacks follow from the placement, see ENSEvaluator,
+    so the output is the optimum of the MIP with X fixed to the placement.\\
+    G : graph of the placement\\
     P : proportion of arcs that can have a switch\\
-    verbal : whether to print gurobi output, assigned switches and objective value
+    solution : dictionary mapping arcs (i, j) -> {0,1}\\
+    verbal : whether to print the objective value and ENS bounds
     """
     
     """
     Setup
     """
-    m = gp.Model()
 
-    """
-    Sets
-    """
-
-    V = G.V
+    timer = PhaseTimer()
+    start = perf_counter()
     A = G.edges
-
-    """
-    Data
-    """
-
-    L_D = {i : G.get_downstream_load(i) for i in V} # Downstream load of node i
-    Theta = {v : G.index_node[v].theta for v in V}
-    M = 2**32 # Very large value
-    P = P
-    # N = floor(P * (len(A) - len(G.substations))) + len(G.substations) # Maximum number of switches that can be placed, including mandatory between substations and root
     N = floor(P * len(A)) + len(G.substations)
-    Outgoing = { # stores nodes that go out of j for incoming (i, j)
-        j : [k for k in V if (j, k) in A]
-        for j in V
-    }
     Elb = G.get_ens_lower_bound()
-    Eub = G.get_ens_upper_bound()
-
-    """
-    Variables
-    """
-
-    X = { # Assignment of switch on arc (i, j)
-        (i, j) : m.addVar(vtype=gp.GRB.BINARY)
-        for i, j in A
-    }
-
-    F = { # Interruption flow on arc (i, j)
-        (i, j) : m.addVar(lb=0)
-        for i, j in A
-    }
-
-    BigF = { # Interruption slack on node j
-        j : m.addVar()
-        for j in V
-    }
-
-    """
-    Objective
-    """
-
-    m.setObjective(
-        gp.quicksum((L_D[i] - L_D[j]) * F[i, j] for (i, j) in A) + Elb,
-        gp.GRB.MINIMIZE
-    )
-
-    """
-    Constraints
-    """
-
-    # We must place switch between root and substation for all substations
-    SwitchesBetweenRootAndSubstation = {
-        (0, j) :
-        m.addConstr(X[0, j] == 1)
-        for j in V if (0, j) in A
-    }
-
-    SwitchPlacements = {
-        (i, j) :
-        m.addConstr(X[i, j] == solution[i, j])
-        for (i, j) in solution
-    }
-
-    # Number of switches <= Max switches
-    m.addConstr(gp.quicksum(X[i, j] for (i, j) in A) <= N)
+    evaluator = get_evaluator(G)
+    placement = evaluator.placement(solution)
 
-    # Node balance constraint
-    NodeBalance = {
-        (i, j) :
-        m.addConstr(
-            BigF[j] + F[i, j] == Theta[j] + gp.quicksum(F[j, k] for k in V if k in Outgoing[j])
-        )
-        for (i, j) in A
-    }
-
-    # Slack only non-zero if switch present on arc
-    SlackCoupling = {
-        (i, j) :
-        m.addConstr(
-            BigF[j] <= M * X[i, j] 
-        )
-        for (i, j) in A
-    }
+    if placement.sum() > N:
+        raise ValueError(f'Placement has {int(placement.sum())} switches, at most {N} are allowed')
+    if not placement[G.tail == 0].all():
+        raise ValueError('Placement is missing switches between the root and the substations')
 
     """
-    Optimize + Output
+    Evaluate + Output
     """
 
-    if not verbal:
-        m.setParam('OutputFlag', 0)
-    m.setParam('MIPGap', 0)
-    m.optimize()
+    with timer.phase('evaluate'):
+        result = evaluator.evaluate(placement)
+        slack = evaluator.slack(result)
+        obj = float(result.ens) + Elb
 
     if verbal:
-        print('ENS', m.ObjVal)
+        print('ENS', obj)
         print('LB:', Elb)
-        print('UB', Eub)
-
-    return ModelOutput(m.ObjVal, {x : round(X[x].X) for x in X}, {x : F[x].X for x in F}, {x : BigF[x].X for x in BigF}, m.Runtime) 
-
-_F_RHS = dict()
-def calculate_F_RHS(i, j, switches_placed, Theta, Outgoing):
-    if (i, j) not in _F_RHS:
-        XV = 1 if (i, j) in switches_placed else 0
+        print('UB', G.get_ens_upper_bound())
 
-        _F_RHS[(i, j)] = (1 - XV) * \
-            (
-                Theta[j] + sum(
-                calculate_F_RHS(j, k, switches_placed, Theta, Outgoing) for k in Outgoing[j]
-                )
-            )
-    return _F_RHS[i, j]
+    with timer.phase('extract'):
+        output = ModelOutput(obj, dict(zip(A, placement.astype(int).tolist())), dict(zip(A, result.F.tolist())),
+            dict(zip(G.vertices.tolist(), slack[G.vertices].tolist())), perf_counter() - start)
+    output.phases = timer.result()
+    return output
 
-_energy_function = dict()
-def energy_function(A : list[tuple[int, int]], switches_placed : list[tuple[int, int]], 
-                    theta : dict[int, float], downstream_load : dict[int, float], 
-                    G:Graph, Eub : float, outgoing):
-    s_switches_placed = frozenset(switches_placed)
-    if s_switches_placed in _energy_function:
-        return _energy_function[s_switches_placed]
-    else:
-        output = 0
-        for i, j in A:
-            downstream_theta = calculate_F_RHS(i, j, switches_placed, theta, outgoing)
-            output += (downstream_load[i] - downstream_load[j]) * downstream_theta
-    global _F_RHS
-    _F_RHS = dict()
-    return output / Eub
-
-def Prob(e_dash, e, T):
-    if e_dash < e:
-        return True
-    r = np.random.random()
-    if r < np.exp(-1 * (e_dash - e) / T):
-        return True
-    return False
 
-from copy import deepcopy
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 
-def run_sa(params : ModelParams):
+def run_sa(params : ModelParams, config : SAConfig = None) -> ModelOutput:
+    """
+    Runs simulated annealing for given parameters, see anneal, and evaluates
+    the best placement found with run_optimisation_fixed. With config.chains
+    above 1 the chains run in parallel, see parallel_anneal, and with
+    config.local_search the best placement is polished with local_search.\\
+    config : settings of the annealing, SAConfig() by default
+    """
+    search_start = perf_counter()
     G = params.G
     P = params.P
     verbal = params.verbal
-
-    downstream_load = {i : G.get_downstream_load(i) for i in G.V}
-    theta = G.theta
-    Eub = G.get_ens_upper_bound()
+    if config is None:
+        config = SAConfig()
 
     A = G.edges
     N = floor(P * len(A)) + len(G.substations)
 
-    # Initial placement
-    A_ = [a for a in A if a[0] != 0]
-    indexes = np.random.choice(len(A_), size = N - len(G.substations))
-    s = [A_[i] for i in indexes]
-
-    outgoing = G.outgoing # stores nodes that go out of j for incoming (i, j)
-
-    k_max = 1000
-    percentage_replace = 0.2
-    n_replace = floor(percentage_replace * len(s))
-
-    e_initial = energy_function(A_, s, theta, downstream_load, G, Eub, outgoing)
-    energy_values = [e_initial]
-
-    best_e = e_initial
-    best_s = s
-
-    temps = []
-
-    T = None
-    a = 0.99
-    for k in tqdm(range(k_max), disable = False):
-
-        to_replace = np.random.choice(len(s), size=n_replace)
-        new_choice = np.random.choice(len(A_), size=n_replace)
-
-        s_new = deepcopy(s)
-        for t, n in zip(to_replace, new_choice):
-            s_new[t] = A_[n]
-
-        e_s = energy_function(A_, s, theta, downstream_load, G, Eub, outgoing)
-        e_s_new = energy_function(A_, s_new, theta, downstream_load, G, Eub, outgoing)
-
-        deltaE = abs(e_s_new - e_s)
-        if T is None:
-            T = -deltaE / np.log(0.5)
-            initial_T = T
-        else:
-            T = a * T
-
-        energy_values.append(e_s)
-        temps.append(T)
-
-        if T < initial_T/100:
-            T = initial_T * (1 - k/k_max)
-
-        if Prob(e_s_new, e_s, T):
-            s = s_new
-
-        if e_s_new < best_e:
-            best_e = e_s_new
-            best_s = s_new
+    if config.chains > 1:
+        result = parallel_anneal(G, N, config)
+    else:
+        result = anneal(G, N, config)
+    placement = result.placement
+    search_time = perf_counter() - search_start
 
-    solution = {
-        s : 1 for s in best_s
-    }
-    for a in A:
-        if a not in solution:
-            solution[a] = 0
-        if a[0] == 0:
-            solution[a] = 1
+    polish_time = 0.0
+    if config.local_search:
+        polished = local_search(G, N, placement)
+        placement = polished.placement
+        polish_time = polished.stats['time']
+    solution = dict(zip(A, placement.astype(int).tolist()))
 
     if verbal:
+        print(f"SA: {result.stats['iterations']} moves at {result.stats['moves_per_second']:.0f} moves/s, best ENS {result.obj}")
+        for chain in result.chains:
+            print(f"Chain {chain['chain']}: best ENS {chain['best_obj']}, {chain['accepted']} accepted, {chain['exchanges']} exchanges, {chain['restarts']} restarts")
+        if config.local_search:
+            print(f"Local search: {polished.stats['one_swaps']} 1-swaps, {polished.stats['two_swaps']} 2-swaps, ENS {polished.obj}")
         fig, ax1 = plt.subplots()
 
         ax1.set_xlabel('Iteration (k)')
         ax2 = ax1.twinx()
-        ax1.plot(energy_values, 'g-')
-        ax2.plot(temps, 'r-')
+        iterations = np.arange(len(result.energies)) * config.record_every
+        ax1.plot(iterations, result.energies, 'g-')
+        ax2.plot(iterations, result.temperatures, 'r-')
 
         custom_lines = [plt.Line2D([0], [0], color='r', lw=4),
                 plt.Line2D([0], [0], color='g', lw=4)]
@@ -254,10 +113,18 @@ def run_sa(params : ModelParams):
 
         ax1.set_ylabel('Energy')
         ax2.set_ylabel('Temperature')
-        plt.title('Simulated Annealing on R6')
+        plt.title(f'Simulated Annealing on R{params.file_number}')
         plt.show()
     
-    return run_optimisation_fixed(G, P, solution)
+    output = run_optimisation_fixed(G, P, solution)
+    timer = PhaseTimer(params.phases)
+    timer.add('search', search_time)
+    timer.add('local_search', polish_time)
+    for name, seconds in output.phases.items():
+        if name != 'peak_memory':
+            timer.add(name, seconds)
+    output.phases = timer.result()
+    return output
 
 if __name__ == "__main__":
     params = ModelParams(5, 0.7, verbal=True)
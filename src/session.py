@@ -0,0 +1,56 @@
+"""
+This module contains SolverSession, which solves one graph for a sequence of P
+values with a single Gurobi model.
+"""
+
+from benders import build_benders, solve_benders
+from mip import build_mip, solve_mip
+from ens import get_evaluator
+from params import ModelParams, ModelOutput
+from warmstart import switch_budget, complete_placement
+
+class SolverSession:
+    """
+    Builds the model of a graph once and re-solves it for each P, changing only
+    the right-hand side of the max switches constraint. Every solve is warm
+    started from the previous optimum, fitted to the new switch budget. Solving
+    for increasing P keeps the previous optimum feasible as it is. The build
+    time is only reported by the output of the first solve.
+    """
+    def __init__(self, params : ModelParams, method : str = 'benders') -> None:
+        """
+        params : parameters of the solves, params.P is set by solve\\
+        method : 'benders' or 'mip'
+        """
+        if method not in ('benders', 'mip'):
+            raise ValueError(f'Unknown method {method}, expected benders or mip')
+        self.params = params
+        self.method = method
+
+        self.built = build_benders(params) if method == 'benders' else build_mip(params)
+        self.previous = None
+
+    def solve(self, P : float) -> ModelOutput:
+        """
+        Solves the model for P, warm started from the previous optimum if there
+        is one, otherwise from the warm start of params.
+        """
+        params = self.params
+        params.P = P
+        placement = None
+        if self.previous is not None:
+            X = get_evaluator(params.G).placement(self.previous.X)
+            placement = complete_placement(params.G, switch_budget(params.G, P), X)
+
+        if self.method == 'benders':
+            output = solve_benders(self.built, params, placement)
+        else:
+            output = solve_mip(self.built, params, placement)
+        self.previous = output
+        return output
+
+    def sweep(self, P_values : list[float]) -> list[ModelOutput]:
+        """
+        Solves the model for every P in P_values, in the given order.
+        """
+        return [self.solve(P) for P in P_values]
@@ -0,0 +1,57 @@
+"""
+This module contains PhaseTimer, which records the wall time of the phases of
+an optimisation run (load, preprocess, build, solve, extract, ...) and the peak
+memory of the process, see ModelOutput.phases.
+"""
+
+import sys
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+def peak_memory() -> int:
+    """
+    Returns the peak resident memory of the process in bytes, or None if it
+    cannot be measured on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class PhaseTimer:
+    """
+    Accumulates wall time in seconds per named phase.
+    """
+    def __init__(self, phases : dict[str, float] = None) -> None:
+        """
+        phases : times of phases that were measured before, e.g. ModelParams.phases
+        """
+        self.phases = dict(phases or {})
+
+    def add(self, name : str, seconds : float) -> None:
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    @contextmanager
+    def phase(self, name : str):
+        """
+        Times the body of a with statement as phase name.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def result(self) -> dict[str, float]:
+        """
+        Returns the phase times and the current peak memory, under 'peak_memory'.
+        """
+        output = dict(self.phases)
+        output['peak_memory'] = peak_memory()
+        return output
@@ -1,143 +1,394 @@
-from reader import read_pos_file, Node, Edge, Info
+from reader import Node, Edge, Info, SwitchArrays
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
 import itertools
+import operator
+from collections.abc import Mapping, Sequence
 from dataclasses import dataclass
 
+def tree_intervals(vertices : np.ndarray, parent : np.ndarray, children : np.ndarray,
+        child_offsets : np.ndarray, root : int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Single pre-order traversal of a radial network.\\
+    Returns (order, tin, tout), tin and tout are indexed by vertex number.
+    The subtree of v is order[tin[v]:tout[v]], so the descendants of v are
+    order[tin[v] + 1:tout[v]]. Vertices unreachable from root are traversed
+    afterwards as roots of their own trees.
+    """
+    size = len(parent)
+    children = children.tolist()
+    child_offsets = child_offsets.tolist()
+    order = []
+    tin = [0] * size
+    tout = [0] * size
+
+    roots = [root] + vertices[(parent[vertices] == -1) & (vertices != root)].tolist()
+    for start in roots:
+        # stack of (vertex, exiting), exiting entries close the interval of vertex
+        stack = [(start, False)]
+        while stack:
+            v, exiting = stack.pop()
+            if exiting:
+                tout[v] = len(order)
+                continue
+            tin[v] = len(order)
+            order.append(v)
+            stack.append((v, True))
+            stack.extend((c, False) for c in reversed(children[child_offsets[v]:child_offsets[v + 1]]))
+    return (np.array(order, dtype=np.int64), np.array(tin, dtype=np.int64),
+            np.array(tout, dtype=np.int64))
+
+class _VertexView(Mapping):
+    """
+    Read-only mapping index -> value, backed by an array indexed by vertex number.
+    """
+    def __init__(self, graph : 'Graph', values : np.ndarray) -> None:
+        self._graph = graph
+        self._values = values
+
+    def __getitem__(self, index : int):
+        if not self._graph.has_vertex(index):
+            raise KeyError(index)
+        return self._values[index].item()
+
+    def __iter__(self):
+        return iter(self._graph.vertices.tolist())
+
+    def __len__(self) -> int:
+        return len(self._graph.vertices)
+
+class _NodeView(_VertexView):
+    """
+    Read-only mapping index -> Node, the Node is built on access.
+    """
+    def __init__(self, graph : 'Graph') -> None:
+        self._graph = graph
+
+    def __getitem__(self, index : int) -> Node:
+        if not self._graph.has_vertex(index):
+            raise KeyError(index)
+        G = self._graph
+        return Node(index, G.theta_array[index].item(), 
+                G.power_array[index].item(), G.clients_array[index].item())
+
+class _ChildrenView(_VertexView):
+    """
+    Read-only mapping index -> set of children, built on access from the
+    CSR arrays of a Graph.
+    """
+    def __init__(self, graph : 'Graph') -> None:
+        self._graph = graph
+
+    def __getitem__(self, index : int) -> set[int]:
+        if not self._graph.has_vertex(index):
+            raise KeyError(index)
+        return set(self._graph.children_of(index).tolist())
+
+class _DescendantsView(_VertexView):
+    """
+    Read-only mapping index -> set of descendants, built on access from the
+    pre-order intervals of a Graph.
+    """
+    def __init__(self, graph : 'Graph') -> None:
+        self._graph = graph
+
+    def __getitem__(self, index : int) -> set[int]:
+        if not self._graph.has_vertex(index):
+            raise KeyError(index)
+        return set(self._graph.descendants(index).tolist())
+
+class _SuccessorArcsView(Mapping):
+    """
+    Read-only mapping arc (i, j) -> set of arcs below j, built on access from
+    the pre-order intervals of a Graph.
+    """
+    def __init__(self, graph : 'Graph') -> None:
+        self._graph = graph
+
+    def __getitem__(self, arc : tuple[int, int]) -> set[tuple[int, int]]:
+        if arc not in self._graph.edges:
+            raise KeyError(arc)
+        return self._graph.get_successor_arcs(arc[1])
+
+    def __iter__(self):
+        return iter(self._graph.edges)
+
+    def __len__(self) -> int:
+        return len(self._graph.edges)
+
+class _ArcList(Sequence):
+    """
+    Read-only list of arcs (i, j), backed by the tail and head arrays of a Graph.
+    Membership is checked against the parent array in constant time.
+    """
+    def __init__(self, graph : 'Graph') -> None:
+        self._graph = graph
+
+    def __getitem__(self, index):
+        G = self._graph
+        if isinstance(index, slice):
+            return list(zip(G.tail[index].tolist(), G.head[index].tolist()))
+        return (G.tail[index].item(), G.head[index].item())
+
+    def __iter__(self):
+        return zip(self._graph.tail.tolist(), self._graph.head.tolist())
+
+    def __len__(self) -> int:
+        return len(self._graph.head)
+
+    def __contains__(self, arc) -> bool:
+        try:
+            i, j = arc
+        except (TypeError, ValueError):
+            return False
+        return self._graph.has_vertex(j) and i != -1 and bool(self._graph.parent[j] == i)
+
+    def index(self, arc) -> int:
+        if arc not in self:
+            raise ValueError(f'{arc} is not an arc')
+        return self._graph.arc_id[arc[1]].item()
+
 @dataclass
-class GraphPickle:
-    vertices : list[int]
-    edges : list[tuple[int, int]]
-    G : nx.DiGraph
-    substations : set[int]
-    successors_tuples : list[tuple[int, set[int]]]
-    successors_arcs_tuples : list[tuple[tuple[int, int], set[tuple[int, int]]]]
-    theta_tuples : list[tuple[int, float]]
-    downstream_load_tuples : list[tuple[int, float]]
-    outgoing : list[tuple[int, set[int]]]
-    index_node : list[tuple[int, Node]]
-    M : int
+class Sectors:
+    """
+    Decomposition of the arcs of a graph into sectors, the arcs between switches.\\
+    Sector s is the root arc roots[s] and every arc below it up to the next
+    switched arcs, its arcs are arcs[offsets[s]:offsets[s + 1]] in pre-order.
+    Sectors are ordered by the pre-order of their root arcs.\\
+    roots : root arc of each sector, an arc without a switch whose parent arc has one\\
+    offsets : start of each sector in arcs, with a final entry len(arcs)\\
+    arcs : arcs without a switch, grouped by sector\\
+    sector : sector of each arc, -1 on switched arcs\\
+    Arcs are indexes into G.edges.
+    """
+    roots : np.ndarray
+    offsets : np.ndarray
+    arcs : np.ndarray
+    sector : np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.roots)
+
+    def arcs_of(self, s : int) -> np.ndarray:
+        return self.arcs[self.offsets[s]:self.offsets[s + 1]]
 
 class Graph:
     """
-    Object for retrieving processed data from dataset
+    Object for retrieving processed data from dataset.\\
+    Node data and topology are stored in arrays indexed by vertex number:
+    parent, children (CSR, children of v are children[child_offsets[v]:child_offsets[v + 1]]),
+    arc_id (index into edges of the arc entering v), theta_array, power_array,
+    clients_array and load_array. Arcs are stored as tail and head arrays.
+    theta, downstream_load, outgoing, index_node, successors_dict and
+    successor_arcs are dictionary views over these arrays.
     """
-    def __init__(self, info : Info, verbal:bool=False, graph_pickle : GraphPickle = None) -> None:
+    # arrays that fully describe a preprocessed graph, see arrays and from_arrays
+    ARRAY_NAMES = ('vertices', 'tail', 'head', 'theta_array', 'power_array', 'clients_array',
+        'load_array', 'parent', 'children', 'child_offsets', 'arc_id', 'order', 'tin', 'tout', '_present')
+
+    def __init__(self, info : Info, verbal:bool=False) -> None:
         """
         info : Info object generated from a dataset \n
         verbal : prints whether origin node was added successfully
         """
-        if graph_pickle is None:
-            self.info = info
-            
-            # Maps node num to bus object
-            self.index_node:dict[int, Node] = {x.index : x for x in self.info.nodes}
-
-            vertices = [node.index for node in info.nodes]
-            edges = [(edge.node1, edge.node2) for edge in info.edges]
-
-            # Add an origin node and edges to each substation for convenience
-            node0 = Node(0, 0, 0, 0)
-            for index in vertices:
-                if self.index_node[index].clients == -1:
-                    edges.append((0, index))
-            self.index_node[0] = node0
-            vertices.append(node0.index)
-            self.vertices = vertices
-
-            # make graph with networkx
-            self.G = nx.DiGraph()
-            self.G.add_nodes_from(vertices)
-            self.G.add_edges_from(edges)
-
-            self.substations = {i for i in self.index_node.keys() if self.index_node[i].clients == -1}
-
-            # successors are nodes that can be reached from the given node
-            self.successors_dict:dict[int, set] = {index : nx.descendants(self.G, index) for index in vertices}
-
-            # maps index -> theta value
-            self.theta = {x.index : x.theta for x in info.nodes}
-            self.theta[0] = 0
-
-            if verbal:
-                if (self.successors_dict[0] | {0} != set(vertices)):
-                    print('Graph is not fully connected from origin.')
-                else:
-                    print('Graph is fully connected from origin.')
-
-            self.edges = edges
-            self.V = self.successors_dict.keys()
-            self.successor_arcs = {a : self.get_successor_arcs(a[1]) for a in self.edges}
-
-            self._downstream_theta = dict()
-            self.outgoing = {i : set() for i in self.V}
-            for i, j in self.edges:
-                self.outgoing[i] = self.outgoing[i] | {j}
-
-            self.downstream_load = {}
-            self.downstream_load = {i : self.get_downstream_load(i) for i in self.V}
-
-            self.M = 10 * sum([self.theta[t] for t in self.theta])
-        else:
-            self.vertices = graph_pickle.vertices
-            self.edges = graph_pickle.edges
-            self.G = graph_pickle.G
-            self.substations = graph_pickle.substations
-            self.successors_dict = {i[0] : i[1] for i in graph_pickle.successors_tuples}
-            self.theta = {i[0] : i[1] for i in graph_pickle.theta_tuples}
-            self.successor_arcs = {i[0] : i[1] for i in graph_pickle.successors_arcs_tuples}
-            self.downstream_load = {i[0] : i[1] for i in graph_pickle.downstream_load_tuples}
-            self.outgoing = {i[0] : i[1] for i in graph_pickle.outgoing}
-            self.index_node = {i[0] : i[1] for i in graph_pickle.index_node}
-            self.M = graph_pickle.M
-            self.V = self.successors_dict.keys()
-
-    def to_graph_pickle(self) -> GraphPickle:
-        return GraphPickle(
-            vertices = self.vertices,
-            edges = self.edges,
-            G = self.G,
-            substations = self.substations,
-            successors_tuples = [(i, self.successors_dict[i]) for i in self.successors_dict],
-            successors_arcs_tuples = [(i, self.successor_arcs[i]) for i in self.successor_arcs],
-            theta_tuples = [(i, self.theta[i]) for i in self.theta],
-            downstream_load_tuples = [(i, self.downstream_load[i]) for i in self.downstream_load],
-            outgoing = [(i, self.outgoing[i]) for i in self.outgoing],
-            index_node = [(i, self.index_node[i]) for i in self.index_node],
-            M = self.M
-        )
+        vertices = np.fromiter((x.index for x in info.nodes), dtype=np.int64, count=len(info.nodes))
+        theta = np.fromiter((x.theta for x in info.nodes), dtype=np.float64, count=len(info.nodes))
+        power = np.fromiter((x.power for x in info.nodes), dtype=np.float64, count=len(info.nodes))
+        clients = np.fromiter((x.clients for x in info.nodes), dtype=np.int64, count=len(info.nodes))
+        tail = np.fromiter((x.node1 for x in info.edges), dtype=np.int64, count=len(info.edges))
+        head = np.fromiter((x.node2 for x in info.edges), dtype=np.int64, count=len(info.edges))
+        self._build_from_columns(vertices, theta, power, clients, tail, head, verbal)
+
+    @classmethod
+    def from_switch_arrays(cls, arrays : SwitchArrays, verbal : bool = False) -> 'Graph':
+        """
+        Creates a graph from the columns of read_switch_arrays.\\
+        verbal : prints whether origin node was added successfully
+        """
+        G = cls.__new__(cls)
+        G._build_from_columns(arrays.index, arrays.theta, arrays.power, arrays.clients,
+            arrays.node1, arrays.node2, verbal)
+        return G
+
+    def _build_from_columns(self, vertices : np.ndarray, theta : np.ndarray, power : np.ndarray,
+            clients : np.ndarray, tail : np.ndarray, head : np.ndarray, verbal : bool) -> None:
+        """
+        Adds the origin node to the node and arc columns of a dataset and builds the graph.
+        """
+        # Add an origin node and edges to each substation for convenience
+        substations = vertices[clients == -1]
+        vertices = np.append(vertices, 0)
+        theta = np.append(theta, 0)
+        power = np.append(power, 0)
+        clients = np.append(clients, 0)
+        tail = np.concatenate([tail, np.zeros(len(substations), dtype=np.int64)])
+        head = np.concatenate([head, substations])
+
+        self._build(vertices, theta, power, clients, tail, head)
+
+        if verbal:
+            if (self.tout[0] - self.tin[0] != len(self.vertices)):
+                print('Graph is not fully connected from origin.')
+            else:
+                print('Graph is fully connected from origin.')
+
+    def _build(self, vertices : np.ndarray, theta : np.ndarray, power : np.ndarray,
+            clients : np.ndarray, tail : np.ndarray, head : np.ndarray) -> None:
+        """
+        Builds the arrays and views from node columns (in vertices order) and
+        arc columns, which already include the origin node and its arcs.
+        """
+        self.vertices = vertices
+        self.tail = tail
+        self.head = head
+        size = int(vertices.max()) + 1
+
+        self._present = np.zeros(size, dtype=bool)
+        self._present[vertices] = True
+
+        # node data indexed by vertex number
+        self.theta_array = np.zeros(size)
+        self.theta_array[vertices] = theta
+        self.power_array = np.zeros(size)
+        self.power_array[vertices] = power
+        self.clients_array = np.zeros(size, dtype=np.int64)
+        self.clients_array[vertices] = clients
+
+        self.arc_id = np.full(size, -1, dtype=np.int64)
+        self.arc_id[head] = np.arange(len(head))
+
+        self.parent = np.full(size, -1, dtype=np.int64)
+        self.parent[head] = tail
+
+        # children in CSR form, in the order of the arcs
+        by_tail = np.argsort(tail, kind='stable')
+        self.children = head[by_tail]
+        self.child_offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tail, minlength=size), out=self.child_offsets[1:])
+
+        # pre-order intervals, the descendants of v are order[tin[v] + 1:tout[v]]
+        self.order, self.tin, self.tout = tree_intervals(
+            vertices, self.parent, self.children, self.child_offsets)
+
+        # substation load is not counted in downstream load
+        own_load = np.where(self.clients_array == -1, 0, self.power_array)
+        self.load_array = self._interval_sums(own_load)
+
+        self._attach_views()
+
+    def _attach_views(self) -> None:
+        """
+        Creates the dictionary views and scalars from the arrays.
+        """
+        self.substations = set(self.vertices[self.clients_array[self.vertices] == -1].tolist())
+
+        self.edges = _ArcList(self)
+        self.theta = _VertexView(self, self.theta_array)
+        self.downstream_load = _VertexView(self, self.load_array)
+        self.index_node = _NodeView(self)
+        self.outgoing = _ChildrenView(self)
+        # successors are nodes that can be reached from the given node
+        self.successors_dict = _DescendantsView(self)
+        self.successor_arcs = _SuccessorArcsView(self)
+        self.V = self.theta.keys()
+
+        self.M = 10 * self.theta_array.sum().item()
+        self._G = None
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        Returns the arrays that describe the graph, keyed by ARRAY_NAMES.
+        """
+        return {name : getattr(self, name) for name in self.ARRAY_NAMES}
+
+    @classmethod
+    def from_arrays(cls, arrays : dict[str, np.ndarray]) -> 'Graph':
+        """
+        Creates a graph from the output of arrays without copying or
+        recomputing them, e.g. from memory-mapped arrays.
+        """
+        G = cls.__new__(cls)
+        for name in cls.ARRAY_NAMES:
+            setattr(G, name, arrays[name])
+        G._attach_views()
+        return G
+
+    @property
+    def G(self) -> nx.DiGraph:
+        """
+        networkx graph of the network, built on first access.
+        """
+        if self._G is None:
+            self._G = nx.DiGraph()
+            self._G.add_nodes_from(self.vertices.tolist())
+            self._G.add_edges_from(self.edges)
+        return self._G
+
+    def has_vertex(self, index : int) -> bool:
+        """
+        Returns whether index is a vertex of the graph.
+        """
+        try:
+            index = operator.index(index)
+        except TypeError:
+            return False
+        return 0 <= index < len(self._present) and bool(self._present[index])
+
+    def children_of(self, index : int) -> np.ndarray:
+        """
+        Returns the children of node as a view of the CSR array.\\
+        index : node to find children of
+        """
+        return self.children[self.child_offsets[index]:self.child_offsets[index + 1]]
+
+    def descendants(self, index : int) -> np.ndarray:
+        """
+        Returns the descendants of node as a view of the pre-order array.\\
+        index : origin to find descendants of
+        """
+        return self.order[self.tin[index] + 1:self.tout[index]]
+
+    def _interval_sums(self, values : np.ndarray) -> np.ndarray:
+        """
+        Sums values over the subtree of every node with one prefix sum over
+        the pre-order array.\\
+        values : array indexed by vertex number, value of that node alone
+        """
+        prefix = np.zeros(len(self.order) + 1)
+        np.cumsum(values[self.order], out=prefix[1:])
+        return prefix[self.tout] - prefix[self.tin]
 
     def get_downstream_load(self, index : int) -> float:
         """
         Calculates load of descendant nodes from node\n
         index : origin to calculate from
         """
-        if index not in self.downstream_load:
-            nodes = self.successors_dict[index] | {index}
-            self.downstream_load[index] = \
-                sum(self.index_node[i].power for i in nodes if i not in self.substations)
         return self.downstream_load[index]
 
-    def get_successor_arcs(self, index : int):
-        successors = self.successors_dict[index] | {index}
-        successors_arcs = set()
-        for a in self.edges:
-            if a[0] in successors and a[1] in successors:
-                successors_arcs.add(a)
-        return successors_arcs
+    def get_successor_arcs(self, index : int) -> set[tuple[int, int]]:
+        """
+        Returns the arcs between descendants of node.\\
+        index : origin to find arcs from
+        """
+        descendants = self.descendants(index)
+        return set(zip(self.parent[descendants].tolist(), descendants.tolist()))
     
     def get_ens_lower_bound(self) -> float:
         """
         Calculates ENS lower bound
         """
-        return sum(self.get_downstream_load(i) * self.theta[i] for i in self.G.nodes if i not in self.substations)
+        v = self.vertices
+        mask = self.clients_array[v] != -1
+        return float(np.dot(self.load_array[v][mask], self.theta_array[v][mask]))
     
     def get_ens_upper_bound(self) -> float:
         """
         Calculates ENS upper bound
         """
+        subtree_theta = self._interval_sums(self.theta_array)
         return sum(
-            self.get_downstream_load(substation) * sum(self.theta[i] for i in self.successors_dict[substation])
+            self.get_downstream_load(substation) * (subtree_theta[substation] - self.theta_array[substation])
             for substation in self.substations
         )
 
@@ -164,19 +415,6 @@ class Graph:
                 edge_color="gray", linewidths=1.5)
         plt.show()
 
-    def calculate_downstream_theta(self, i, j, XV):
-        """
-        Returns the downstream theta of (i, j) within the current
-        solution.
-        """
-        if (i, j) not in self._downstream_theta:
-            self._downstream_theta[(i, j)] = (1 - XV[i, j]) *\
-                (self.theta[j] + 
-                    sum(self.calculate_downstream_theta(j, k, XV) for k in self.outgoing[j])
-                )
-                
-        return self._downstream_theta[i, j]
-    
     def calculate_ENS(self, subtree : set[tuple[int, int]], 
             XV : dict[tuple[int, int], int]) -> float:
         """
@@ -184,49 +422,53 @@ class Graph:
         subtree : set of arcs (i, j)\\
         XV : A dictionary mapping arcs (i, j) -> {0,1}, representing switch placement.
         """
-        self._downstream_theta = dict()
-        return sum(
-            (self.downstream_load[a[0]] - self.downstream_load[a[1]]) *\
-            self.calculate_downstream_theta(*a, XV) for a in subtree
-        )
+        from ens import get_evaluator
+        evaluator = get_evaluator(self)
+        result = evaluator.evaluate(evaluator.placement(XV))
+        arcs = [self.edges.index(a) for a in subtree]
+        return float(np.dot(evaluator.weight[arcs], result.F[arcs]))
     
-    def get_subtrees(self, XV : dict[tuple[int, int], int]) -> list[set[tuple[int, int]]]:
+    def get_sectors(self, X : np.ndarray) -> Sectors:
         """
-        Returns a list of set of tuples representing arcs between switches.\\
-        XV : A dictionary mapping arcs (i, j) -> {0,1}, representing switch placement.
+        Returns the sectors of a placement vector in the order of G.edges.\\
+        Every arc is labelled with the root arc of its sector in one walk over
+        the arcs in pre-order, which takes O(|A|).
         """
-        blocked_off_trees = {a : self.successor_arcs[a] | {a} 
-                            for a in XV if XV[a] == 1}
-        explored = set()
-        output = []
+        open_arc = np.asarray(X) == 0
+        n = len(open_arc)
+        parent_arc = self.arc_id[self.tail].tolist()
+        is_open = open_arc.tolist()
 
-        for arc in XV:
-            if XV[arc] == 1 or arc in explored:
-                continue
-            arc_tree = self.successor_arcs[arc] | {arc}
-            for root in blocked_off_trees:
-                if root in arc_tree:
-                    arc_tree = arc_tree.difference(blocked_off_trees[root])
-            explored |= arc_tree
-            output.append(tuple(arc_tree))
-        return output
-
-import os.path
-import pickle
-def load_graph_object(file_number) -> Graph:
-    filename = f'graphs/graph_{file_number}.pickle'
-    if os.path.isfile(filename):
-        G = None
-        with open(filename, 'rb') as handle:
-            G = pickle.load(handle)
-        G = Graph(info = None, graph_pickle= G)
-        return G
-    
-    networkfile = f'networks/R{file_number}.switch'
-    F = read_pos_file(networkfile)
-    G = Graph(F)
-    G_pickle = G.to_graph_pickle()
-
-    with open(filename, 'wb') as handle:
-        pickle.dump(G_pickle, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    return G
+        # arcs in pre-order, every parent arc is labelled before its children
+        arcs = self.arc_id[self.order]
+        arcs = arcs[arcs >= 0]
+
+        # open arcs below an open arc take its label, roots and switched arcs label themselves
+        label = list(range(n))
+        for a in arcs.tolist():
+            p = parent_arc[a]
+            if is_open[a] and p >= 0 and is_open[p]:
+                label[a] = label[p]
+        label = np.array(label, dtype=np.int64)
+
+        # open arcs in pre-order, grouped by the pre-order of their root
+        arcs = arcs[open_arc[arcs]]
+        arcs = arcs[np.argsort(self.tin[self.head[label[arcs]]], kind='stable')]
+        starts = np.flatnonzero(np.diff(label[arcs], prepend=-1))
+        offsets = np.append(starts, len(arcs))
+
+        sector = np.full(n, -1, dtype=np.int64)
+        sector[arcs] = np.repeat(np.arange(len(starts)), np.diff(offsets))
+        return Sectors(label[arcs[starts]], offsets, arcs, sector)
+
+    def get_subtrees(self, XV : dict[tuple[int, int], int]) -> list[tuple[tuple[int, int]]]:
+        """
+        Returns a list of tuples of arcs between switches, one per sector, see get_sectors.\\
+        XV : A dictionary mapping arcs (i, j) -> {0,1}, representing switch placement.
+        """
+        X = np.fromiter((XV[a] for a in self.edges), dtype=np.float64, count=len(self.edges))
+        sectors = self.get_sectors(X)
+        tail = self.tail.tolist()
+        head = self.head.tolist()
+        return [tuple((tail[a], head[a]) for a in sectors.arcs_of(s).tolist())
+            for s in range(len(sectors))]
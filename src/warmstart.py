@@ -0,0 +1,101 @@
+"""
+This module contains the warm starts of run_benders and run_mip: a placement
+from a fast heuristic or a previous solution, fitted to the switch budget.
+It needs no Gurobi, see formulation.set_mip_start for giving a placement to a model.
+"""
+
+import heapq
+import numpy as np
+from math import floor
+from util import Graph
+from ens import IncrementalENS, get_evaluator
+from anneal import SAConfig, anneal
+from params import ModelParams
+
+def switch_budget(G : Graph, P : float) -> int:
+    """
+    Returns the maximum number of switches, including the mandatory switches
+    between the root and the substations.
+    """
+    return floor(P * len(G.edges)) + len(G.substations)
+
+def greedy_placement(G : Graph, N : int, X : np.ndarray = None, candidates : np.ndarray = None) -> np.ndarray:
+    """
+    Adds switches one at a time on the arc that lowers ENS the most, until N
+    switches are placed or no switch lowers ENS.\\
+    Adding a switch never raises the saving of another arc, so savings are kept
+    in a heap and only the top is recomputed (lazy greedy).\\
+    X : initial placement vector, by default only the switches between the root and the substations\\
+    candidates : boolean mask of the arcs a switch can be added on, by default every arc
+    """
+    evaluator = get_evaluator(G)
+    if X is None:
+        X = (G.tail == 0).astype(np.float64)
+    X = np.asarray(X, dtype=np.float64)
+    if candidates is None:
+        candidates = np.ones(len(X), dtype=bool)
+
+    # saving of every open arc: its downstream theta times the weight up to the sector top
+    result = evaluator.evaluate(X)
+    sectors = G.get_sectors(X)
+    open_arcs = sectors.arcs[candidates[sectors.arcs]]
+    top = G.tail[sectors.roots[sectors.sector[open_arcs]]]
+    savings = result.R[open_arcs] * (evaluator.prefix_weight[G.head[open_arcs]] - evaluator.prefix_weight[top])
+
+    heap = [(-saving, a) for saving, a in zip(savings.tolist(), open_arcs.tolist()) if saving > 0]
+    heapq.heapify(heap)
+    ens = IncrementalENS(evaluator, X, result)
+    count = int(X.sum())
+    while count < N and heap:
+        _, a = heapq.heappop(heap)
+        saving = -ens.delta(a)
+        if heap and saving < -heap[0][0]:
+            heapq.heappush(heap, (-saving, a))
+            continue
+        if saving <= 0:
+            break
+        ens.toggle(a)
+        count += 1
+    return ens.placement()
+
+def warm_start_placement(params : ModelParams) -> np.ndarray:
+    """
+    Returns the placement vector of the warm start chosen by params.warm_start,
+    or None without a warm start. 'sa' runs anneal and local_search with the
+    default SAConfig, seeded with params.gurobi_seed. A given placement is
+    fitted to the switch budget with complete_placement.
+    """
+    G = params.G
+    warm_start = params.warm_start
+    if warm_start is None:
+        return None
+
+    N = switch_budget(G, params.P)
+    if isinstance(warm_start, str):
+        if warm_start == 'greedy':
+            return greedy_placement(G, N)
+        if warm_start == 'sa':
+            # localsearch fits its start with complete_placement from this module
+            from localsearch import local_search
+            # seeded like Gurobi, so runs with a fixed gurobi_seed start from the same placement
+            config = SAConfig(seed=params.gurobi_seed)
+            warm_start = anneal(G, N, config).placement
+            if config.local_search:
+                warm_start = local_search(G, N, warm_start).placement
+        else:
+            raise ValueError(f'Unknown warm start {warm_start}, expected greedy, sa or a placement')
+
+    if isinstance(warm_start, dict):
+        warm_start = get_evaluator(G).placement(warm_start)
+    return complete_placement(G, N, warm_start)
+
+def complete_placement(G : Graph, N : int, X : np.ndarray) -> np.ndarray:
+    """
+    Returns a placement within the switch budget N from a placement vector. A
+    placement above the budget keeps the best N of its switches, one below the
+    budget is completed greedily.
+    """
+    X = np.maximum(np.asarray(X, dtype=np.float64), G.tail == 0)
+    if X.sum() > N:
+        return greedy_placement(G, N, candidates = X == 1)
+    return greedy_placement(G, N, X)